@@ -0,0 +1,26 @@
+import copy
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from shop.models import Customer
+
+from .cache import user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id) if user_id is not None else None
+
+        if user is None:
+            version = user_cache.version(user_id)
+            user = super().get_user(validated_token)
+            # loads the customer once so views can use request.user.customer for free
+            try:
+                user.customer
+            except Customer.DoesNotExist:
+                pass
+            user_cache.set(user_id, user, version)
+
+        return copy.deepcopy(user)
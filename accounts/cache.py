@@ -0,0 +1,63 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+from shop.cache import LRUCache
+
+
+class UserCache(LRUCache):
+    """
+    Authenticated users kept per process. Every entry remembers the version
+    stamp of its user in the shared cache, and is only served while the stamp
+    is unchanged, so an invalidation in one worker reaches all of them.
+    """
+
+    def __init__(self, max_size, ttl, cache_alias='default'):
+        super().__init__(max_size, ttl)
+        self.cache_alias = cache_alias
+
+    def shared_cache(self):
+        return caches[self.cache_alias]
+
+    def version_key(self, user_id):
+        return f'auth-user-version:{user_id}'
+
+    def version(self, user_id):
+        # read before loading the user, a change in between then makes the entry stale right away.
+        # stamps are random, so one that was evicted and created again matches no old entry
+        shared_cache = self.shared_cache()
+        key = self.version_key(user_id)
+        version = shared_cache.get(key)
+        if version is None:
+            shared_cache.add(key, uuid4().hex, timeout=None)
+            version = shared_cache.get(key)
+        return version
+
+    # token claims may carry the id as a string
+    def get(self, user_id):
+        user_id = str(user_id)
+        entry = super().get(user_id)
+        if entry is None:
+            return None
+
+        version, user = entry
+        if self.version(user_id) != version:
+            super().invalidate(user_id)
+            return None
+        return user
+
+    def set(self, user_id, user, version=None, ttl=None):
+        super().set(str(user_id), (version, user), ttl)
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        super().invalidate(user_id)
+        self.shared_cache().set(self.version_key(user_id), uuid4().hex, timeout=None)
+
+
+user_cache = UserCache(
+    max_size=getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 60),
+    cache_alias=getattr(settings, 'AUTH_USER_CACHE', 'default'),
+)
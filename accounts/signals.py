@@ -1,8 +1,26 @@
 from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+from django.conf import settings
+from django.db import transaction
+
 from shop.signals import order_created
+from .cache import user_cache
 
 
 @receiver(order_created)
 def after_order_created(sender, **kwargs):
      print(f"New order created from {kwargs['order'].id}")
-     
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # after the commit, or another request could cache the old row again under the new stamp
+    transaction.on_commit(lambda: user_cache.invalidate(instance.pk))
+
+
+@receiver(post_save, sender='shop.Customer')
+@receiver(post_delete, sender='shop.Customer')
+def invalidate_cached_customer_user(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        transaction.on_commit(lambda: user_cache.invalidate(instance.user_id))
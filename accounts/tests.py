@@ -1,3 +1,61 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .cache import UserCache, user_cache
+
+
+class UserCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # two workers sharing the default cache
+        self.first = UserCache(max_size=10, ttl=60)
+        self.second = UserCache(max_size=10, ttl=60)
+
+    def test_cached_users_are_served(self):
+        self.first.set(1, 'user', self.first.version(1))
+        self.assertEqual(self.first.get('1'), 'user')
+
+    def test_invalidation_reaches_other_workers(self):
+        self.first.set(1, 'user', self.first.version(1))
+        self.first.set(2, 'other user', self.first.version(2))
+        self.second.invalidate(1)
+        self.assertIsNone(self.first.get(1))
+        self.assertEqual(self.first.get(2), 'other user')
+
+    def test_a_lost_stamp_does_not_match(self):
+        self.first.set(1, 'user', self.first.version(1))
+        cache.delete(self.first.version_key(1))
+        self.assertIsNone(self.first.get(1))
+
+
+class CachedJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = get_user_model().objects.create_user('staff', password='password', is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+
+    def save_user(self, **fields):
+        for name, value in fields.items():
+            setattr(self.user, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+    def test_deactivated_users_are_rejected(self):
+        self.assertEqual(self.client.get('/orders/').status_code, 200)
+        self.save_user(is_active=False)
+        self.assertEqual(self.client.get('/orders/').status_code, 401)
+
+    def test_lost_staff_status_is_seen(self):
+        self.assertEqual(self.client.get('/customers/').status_code, 200)
+        self.save_user(is_staff=False)
+        self.assertEqual(self.client.get('/customers/').status_code, 403)
+
+    def test_warm_requests_skip_the_user_query(self):
+        self.client.get('/orders/')
+        # only the count of the (empty) order page, no user or customer query
+        with self.assertNumQueries(1):
+            self.client.get('/orders/')
@@ -22,6 +22,7 @@ from django.conf.urls.static import static
 
 admin.site.site_header = 'Django administration'
 admin.site.index_title = 'Special access'
+admin.site.index_template = 'admin/shop_index.html'
 
 
 urlpatterns = [
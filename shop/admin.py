@@ -1,11 +1,125 @@
+import hashlib
+
 from django.contrib import admin
-from django.db.models import Count
-from django.utils.html import format_html
+from django.contrib.admin.utils import label_for_field, lookup_field
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+from django.utils.html import format_html, strip_tags
+from django.utils.safestring import SafeData
 from django.utils.http import urlencode
 from django.urls import reverse
 from django.contrib import messages
-
-from .models import Product, Cart, CartItem, Category, Comment, Customer ,Order, OrderItem, Discount, Address
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django import forms
+
+from .analytics import order_sales, apply_sales_delta, track_order_sales
+from .transitions import transition_orders, TRANSITION_DONE
+from .search import search_customers
+from .bulk_jobs import queue_job
+from .exports import iterate_in_chunks, render_csv
+from .models import Product, Cart, CartItem, Category, Comment, Customer ,Order, OrderItem, Discount, Address, \
+    ArchivedOrder, ArchivedOrderItem, OrderStatusCount, EmailJob, AdminBulkJob
+
+
+def estimated_table_rows(queryset):
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    estimate_threshold = 100000
+    cache_timeout = 60
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        # an unfiltered changelist can use the table statistics instead of COUNT(*)
+        if not queryset.query.where:
+            estimate = estimated_table_rows(queryset)
+            if estimate and estimate >= self.estimate_threshold:
+                return estimate
+
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            # e.g. a filter on an empty list of ids, it cannot match any row
+            return 0
+        key = 'admin-count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        return cache.get_or_set(key, queryset.count, self.cache_timeout)
+
+
+class BulkJobActionMixin:
+    def queue_bulk_job(self, request, queryset, action):
+        # a select across of a large table is queued as its changelist filters, not as its ids
+        changelist_query = None
+        if request.POST.get('select_across') == '1':
+            params = request.GET.copy()
+            params.pop('p', None)
+            changelist_query = params.urlencode()
+        job = queue_job(action, queryset, request.user, changelist_query)
+        self.message_user(request, f"{job} queued, it runs in the background in chunks.", messages.INFO)
+        return HttpResponseRedirect(reverse('admin:shop_adminbulkjob_change', args=[job.pk]))
+
+
+class CsvExportMixin:
+    export_chunk_size = 2000
+
+    def get_export_select_related(self):
+        related = list(self.list_select_related or [])
+        for name in self.list_display:
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.many_to_one or field.one_to_one:
+                related.append(name)
+        return related
+
+    def export_value(self, obj, name):
+        field, attr, value = lookup_field(name, obj, self)
+        if field is not None and field.choices:
+            value = dict(field.flatchoices).get(value, value)
+        if isinstance(value, SafeData):
+            value = strip_tags(value).strip()
+        return '' if value is None else value
+
+    def export_rows(self, queryset):
+        for obj in iterate_in_chunks(queryset, self.export_chunk_size):
+            yield [self.export_value(obj, name) for name in self.list_display]
+
+    @admin.action(description='Export as CSV')
+    def export_as_csv(self, request, queryset):
+        queryset = queryset.select_related(*self.get_export_select_related())
+        columns = [label_for_field(name, self.model, self) for name in self.list_display]
+        response = StreamingHttpResponse(render_csv(self.export_rows(queryset), columns), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{self.model._meta.model_name}s.csv"'
+        return response
+
+
+class FastChangeListMixin:
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
+def subquery_count(model, field):
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field) \
+        .annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -37,7 +151,7 @@ class CommentInline(admin.StackedInline):
     extra = 1
 
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(CsvExportMixin, BulkJobActionMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ['id', 'name', 'category_title' , 'unit_price', 'inventory', 'inventory_status', 'num_of_comments']
     ordering = ['id']
     list_per_page = 20    
@@ -46,7 +160,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = [InventoryFilter, 'category']
     search_fields = ['name__istartswith']
     list_display_links = ['id', 'name']
-    actions = ['clear_inventory']
+    actions = ['clear_inventory', 'export_as_csv']
     prepopulated_fields = {
         'slug': ['name', 'unit_price']
     }
@@ -65,8 +179,7 @@ class ProductAdmin(admin.ModelAdmin):
         return product.category.title
     
     def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('comments'). \
-            annotate(num_of_comments=Count('comments'))
+        return super().get_queryset(request).annotate(num_of_comments=subquery_count(Comment, 'product'))
     
     @admin.display(ordering='num_of_comments')
     def num_of_comments(self, product):
@@ -82,8 +195,7 @@ class ProductAdmin(admin.ModelAdmin):
     
     @admin.action(description='Clear Inventory')
     def clear_inventory(self, request, queryset):
-        update_count = queryset.update(inventory=0)
-        self.message_user(request, f"{update_count} inventories of products cleared.", messages.WARNING)
+        return self.queue_bulk_job(request, queryset, 'clear_inventory')
 
     
 admin.site.register(Product, ProductAdmin)
@@ -111,10 +223,6 @@ class ItemsFilter(admin.SimpleListFilter):
         elif self.value() == ItemsFilter.GREATER_THAN_7:
             return queryset.filter(items_count__gt=7)
     
-    def get_queryset(self):
-        queryset = super(self).get_queryset().annotate(items_count=Count('items'))
-        return queryset
-    
 
 class OrderItemInline(admin.StackedInline):
     model = OrderItem
@@ -124,20 +232,80 @@ class OrderItemInline(admin.StackedInline):
     max_num = 20
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdminForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = '__all__'
+    
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        previous_status = self.instance.status
+        if self.instance.pk and status != previous_status and not Order.can_transition(previous_status, status):
+            raise forms.ValidationError(f"Order status can not change from {previous_status} to {status}.")
+        return status
+
+
+class OrderAdmin(CsvExportMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ['id', 'customer', 'status', 'datetime_created', 'number_of_items']
     ordering = ['id']
     list_per_page = 15    
     list_editable = ['status']
+    list_select_related = ['customer__user']
     list_filter = ['status', ItemsFilter]
-    search_fields = ['customer__first_name', 'customer__last_name']
+    search_fields = ['customer__user__first_name', 'customer__user__last_name']
     list_display_links = ['id']
     inlines = [OrderItemInline]
+    form = OrderAdminForm
+    actions = ['mark_as_paid', 'mark_as_canceled', 'export_as_csv']
     
+    def get_search_results(self, request, queryset, search_term):
+        return search_customers(queryset, search_term, lookup='customer_id'), False
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('items'). \
-            annotate(items_count=Count('items'))
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', OrderAdminForm)
+        return super().get_changelist_form(request, **kwargs)
+    
+    def transition(self, request, queryset, status):
+        outcomes = transition_orders(queryset.values_list('id', flat=True), status, sender=self.__class__)
+        done_count = list(outcomes.values()).count(TRANSITION_DONE)
+        skipped_count = len(outcomes) - done_count
+        self.message_user(request, f"{done_count} orders changed, {skipped_count} orders skipped.", 
+                          messages.SUCCESS if not skipped_count else messages.WARNING)
+    
+    @admin.action(description='Mark as paid')
+    def mark_as_paid(self, request, queryset):
+        self.transition(request, queryset, Order.ORDER_STATUS_PAID)
+    
+    @admin.action(description='Mark as canceled')
+    def mark_as_canceled(self, request, queryset):
+        self.transition(request, queryset, Order.ORDER_STATUS_CANCELED)
+    
+    def save_model(self, request, obj, form, change):
+        obj._sales_before = order_sales([obj.pk]) if change else {}
+        super().save_model(request, obj, form, change)
+        if not change:
+            OrderStatusCount.objects.adjust({obj.status: 1})
+        elif 'status' in form.changed_data:
+            OrderStatusCount.objects.adjust({form.initial['status']: -1, obj.status: 1})
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        OrderStatusCount.objects.adjust({obj.status: -1})
+        Customer.objects.refresh_order_stats(Customer.objects.filter(pk=obj.customer_id))
+    
+    def delete_queryset(self, request, queryset):
+        deltas = dict(queryset.order_by().values_list('status').annotate(count=Count('id')))
+        customer_ids = list(queryset.values_list('customer_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        OrderStatusCount.objects.adjust({status: -count for status, count in deltas.items()})
+        Customer.objects.refresh_order_stats(Customer.objects.filter(pk__in=customer_ids))
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        order = form.instance
+        Order.objects.refresh_totals(Order.objects.filter(pk=order.pk))
+        Customer.objects.refresh_order_stats(Customer.objects.filter(pk=order.customer_id))
+        apply_sales_delta(getattr(order, '_sales_before', {}), order_sales([order.pk]))
     
     @admin.display(ordering='items_count')
     def number_of_items(self, order):
@@ -147,6 +315,33 @@ class OrderAdmin(admin.ModelAdmin):
 admin.site.register(Order, OrderAdmin)
 
 
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ['id', 'product', 'quantity', 'unit_price']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+class ArchivedOrderAdmin(FastChangeListMixin, admin.ModelAdmin):
+    list_display = ['id', 'customer', 'status', 'datetime_created', 'items_count', 'total_amount', 'datetime_archived']
+    ordering = ['-id']
+    list_per_page = 15
+    list_select_related = ['customer__user']
+    list_filter = ['status']
+    search_fields = ['customer__user__first_name__istartswith', 'customer__user__last_name__istartswith']
+    inlines = [ArchivedOrderItemInline]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+
+
 class QuantityFilter(admin.SimpleListFilter):
     title = 'Quantity Status'
     parameter_name = 'quantity'
@@ -170,36 +365,56 @@ class QuantityFilter(admin.SimpleListFilter):
             return queryset.filter(quantity__gt=10)
 
 
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(CsvExportMixin, BulkJobActionMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ['id', 'order', 'product' , 'quantity', 'unit_price']
     ordering = ['id']
     list_per_page = 25
     list_editable = ['unit_price', 'quantity']
-    list_select_related = ['order', 'product']
+    list_select_related = ['order__customer__user', 'product']
     list_filter = [QuantityFilter]
     search_fields = ['product__name']
     list_display_links = ['id', 'order']
     autocomplete_fields = ['product']
-    actions = ['clear_quantity']
+    actions = ['clear_quantity', 'export_as_csv']
+    
+    def refresh_orders(self, order_ids):
+        orders = Order.objects.filter(pk__in=order_ids)
+        Order.objects.refresh_totals(orders)
+        Customer.objects.refresh_order_stats(Customer.objects.filter(pk__in=orders.values('customer_id')))
+    
+    def save_model(self, request, obj, form, change):
+        with track_order_sales([obj.order_id]):
+            super().save_model(request, obj, form, change)
+        self.refresh_orders([obj.order_id])
+    
+    def delete_model(self, request, obj):
+        with track_order_sales([obj.order_id]):
+            super().delete_model(request, obj)
+        self.refresh_orders([obj.order_id])
     
     @admin.action(description='Clear Quantity')
     def clear_quantity(self, request, queryset):
-        update_count = queryset.update(quantity=0)
-        self.message_user(request, f"{update_count} quantities of products cleared.", messages.ERROR)
+        return self.queue_bulk_job(request, queryset, 'clear_quantity')
 
 
 admin.site.register(OrderItem, OrderItemAdmin)
 
 
 
-class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['id', 'first_name', 'last_name' , 'phone_number', 'birth_date', 'email']
+class CustomerAdmin(CsvExportMixin, FastChangeListMixin, admin.ModelAdmin):
+    list_display = ['id', 'first_name', 'last_name' , 'phone_number', 'birth_date', 'email', 
+                    'orders_count', 'total_spent', 'last_order_at']
     ordering = ['id']
     list_per_page = 20    
     list_editable = ['birth_date', 'email']
-    list_filter = ['orders']
+    list_select_related = ['user']
+    list_filter = ['last_order_at']
     search_fields = ['user__first_name__istartswith', 'user__last_name__istartswith']
     list_display_links = ['id', 'first_name']
+    actions = ['export_as_csv']
+    
+    def get_search_results(self, request, queryset, search_term):
+        return search_customers(queryset, search_term), False
     
     # def first_name(self, customer):
     #     return customer.user.first_name
@@ -211,7 +426,7 @@ class CustomerAdmin(admin.ModelAdmin):
 admin.site.register(Customer, CustomerAdmin)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(CsvExportMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ['id', 'product', 'name' , 'status', 'datetime_created']
     ordering = ['id']
     list_per_page = 20    
@@ -221,6 +436,7 @@ class CommentAdmin(admin.ModelAdmin):
     search_fields = ['product__name']
     list_display_links = ['id', 'product']
     autocomplete_fields = ['product']
+    actions = ['export_as_csv']
     # readonly_fields =
     # fields = 
     # exclude =
@@ -237,22 +453,64 @@ class CartItemInline(admin.StackedInline):
     max_num = 20
 
 
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(CsvExportMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ['id', 'created_at', 'number_of_items']
     ordering = ['id']
     list_per_page = 10
     list_filter = [ItemsFilter]
     inlines = [CartItemInline]
+    actions = ['export_as_csv']
     
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('items'). \
-            annotate(items_count=Count('items'))
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Cart.objects.refresh_items_count(Cart.objects.filter(pk=form.instance.pk))
     
     @admin.display(ordering='items_count')
-    def number_of_items(self, order):
-        return order.items_count
+    def number_of_items(self, cart):
+        return cart.items_count
     
     
 admin.site.register(Cart, CartAdmin)
 
+
+class EmailJobAdmin(FastChangeListMixin, admin.ModelAdmin):
+    list_display = ['id', 'to_email', 'subject', 'status', 'attempts', 'datetime_created', 'datetime_sent']
+    ordering = ['-id']
+    list_per_page = 25
+    list_filter = ['status']
+    search_fields = ['to_email']
+    readonly_fields = ['customer', 'attempts', 'last_error', 'datetime_created', 'datetime_sent']
+
+
+admin.site.register(EmailJob, EmailJobAdmin)
+
+
+class AdminBulkJobAdmin(FastChangeListMixin, admin.ModelAdmin):
+    list_display = ['id', 'action', 'model_label', 'status', 'progress_bar', 'rows_affected', 'created_by', 
+                    'datetime_created', 'datetime_finished']
+    ordering = ['-id']
+    list_per_page = 20
+    list_select_related = ['created_by']
+    list_filter = ['status', 'action']
+    fields = ['action', 'model_label', 'status', 'progress_bar', 'done_chunks', 'total_chunks', 'rows_affected', 
+              'cancel_requested', 'created_by', 'datetime_created', 'datetime_started', 'datetime_heartbeat',
+              'datetime_finished', 'error']
+    readonly_fields = fields
+    actions = ['cancel_jobs']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.display(description='progress')
+    def progress_bar(self, job):
+        return format_html("<progress value='{}' max='100'></progress> {}%", job.progress, job.progress)
+    
+    @admin.action(description='Cancel jobs')
+    def cancel_jobs(self, request, queryset):
+        update_count = queryset.filter(status__in=[AdminBulkJob.JOB_STATUS_QUEUED, AdminBulkJob.JOB_STATUS_RUNNING]) \
+            .update(cancel_requested=True)
+        self.message_user(request, f"{update_count} jobs will stop after their current chunk.", messages.WARNING)
+
+
+admin.site.register(AdminBulkJob, AdminBulkJobAdmin)
@@ -0,0 +1,145 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, DecimalField, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, ArchivedOrderItem, DailyProductSales
+
+
+def order_sales(order_ids):
+    sales = defaultdict(lambda: [0, Decimal(0), 0])
+    if not order_ids:
+        return sales
+
+    items = OrderItem.objects.filter(order_id__in=order_ids).values_list(
+        'order__datetime_created', 'order__status', 'product_id', 'product__category_id', 'quantity', 'unit_price'
+    )
+    for datetime_created, status, product_id, category_id, quantity, unit_price in items:
+        key = (timezone.localtime(datetime_created).date(), product_id, category_id, status)
+        sales[key][0] += quantity
+        sales[key][1] += quantity * unit_price
+        sales[key][2] += 1
+    return sales
+
+
+def apply_sales_delta(before, after):
+    deltas = dict()
+    for key in set(before) | set(after):
+        old = before.get(key, [0, Decimal(0), 0])
+        new = after.get(key, [0, Decimal(0), 0])
+        delta = (new[0] - old[0], new[1] - old[1], new[2] - old[2])
+        if any(delta):
+            deltas[(key[0], key[1], key[3])] = (key[2], delta)
+
+    # applied once the order changes commit, like the status counters, so concurrent checkouts of a
+    # popular product do not queue on its rollup rows until their transaction ends.
+    # rebuild_daily_sales rebuilds the rollups if a process dies in between
+    if deltas:
+        transaction.on_commit(lambda: write_sales_deltas(deltas))
+
+
+def write_sales_deltas(deltas):
+    keys = Q()
+    quantities, revenues, order_lines = list(), list(), list()
+    for (date, product_id, status), (_, (quantity, revenue, lines)) in deltas.items():
+        key = Q(date=date, product_id=product_id, status=status)
+        keys |= key
+        quantities.append(When(key, then=Value(quantity)))
+        revenues.append(When(key, then=Value(revenue)))
+        order_lines.append(When(key, then=Value(lines)))
+
+    with transaction.atomic():
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(date=date, product_id=product_id, category_id=category_id, status=status)
+            for (date, product_id, status), (category_id, _) in deltas.items()
+        ], ignore_conflicts=True)
+
+        # one statement of relative increments instead of an UPDATE per product. rows are not
+        # clamped at zero, a negative rollup is drift for rebuild_daily_sales to repair
+        DailyProductSales.objects.filter(keys).update(
+            quantity=F('quantity') + Case(*quantities, default=Value(0)),
+            revenue=F('revenue') + Case(*revenues, default=Value(Decimal(0)),
+                                        output_field=DecimalField(max_digits=14, decimal_places=2)),
+            order_lines=F('order_lines') + Case(*order_lines, default=Value(0)),
+        )
+
+
+def record_order_sales(order_ids):
+    apply_sales_delta({}, order_sales(order_ids))
+
+
+@contextmanager
+def track_order_sales(order_ids):
+    before = order_sales(order_ids)
+    yield
+    apply_sales_delta(before, order_sales(order_ids))
+
+
+def rebuild_daily_sales(start=None, end=None):
+    rows = defaultdict(lambda: [0, Decimal(0), 0, None])
+
+    for model in [OrderItem, ArchivedOrderItem]:
+        items = model.objects.all()
+        if start:
+            items = items.filter(order__datetime_created__date__gte=start)
+        if end:
+            items = items.filter(order__datetime_created__date__lte=end)
+
+        grouped = items.annotate(date=TruncDate('order__datetime_created')).values(
+            'date', 'product_id', 'order__status'
+        ).annotate(
+            category_id=F('product__category_id'),
+            total_quantity=Sum('quantity'),
+            total_revenue=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+            total_lines=Count('id'),
+        ).order_by()
+
+        for row in grouped:
+            key = (row['date'], row['product_id'], row['order__status'])
+            rows[key][0] += row['total_quantity']
+            rows[key][1] += row['total_revenue']
+            rows[key][2] += row['total_lines']
+            rows[key][3] = row['category_id']
+
+    with transaction.atomic():
+        existing = DailyProductSales.objects.all()
+        if start:
+            existing = existing.filter(date__gte=start)
+        if end:
+            existing = existing.filter(date__lte=end)
+        existing.delete()
+
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(
+                date=date, product_id=product_id, category_id=category_id, status=status,
+                quantity=quantity, revenue=revenue, order_lines=order_lines,
+            ) for (date, product_id, status), (quantity, revenue, order_lines, category_id) in rows.items()
+        ], batch_size=1000)
+
+    return len(rows)
+
+
+SALES_GROUPS = {
+    'day': ['date'],
+    'category': ['category_id', 'category__title'],
+    'product': ['product_id', 'product__name'],
+}
+
+
+def sales_report(start, end, group_by='day'):
+    status_aggregates = dict()
+    for status, _ in Order.ORDER_STATUS:
+        status_aggregates[f'quantity_{status}'] = Sum('quantity', filter=Q(status=status))
+        status_aggregates[f'revenue_{status}'] = Sum('revenue', filter=Q(status=status))
+
+    queryset = DailyProductSales.objects.filter(date__range=(start, end)) \
+        .values(*SALES_GROUPS[group_by]) \
+        .annotate(total_quantity=Sum('quantity'), total_revenue=Sum('revenue'), **status_aggregates)
+
+    if group_by == 'day':
+        return queryset.order_by('date')
+    return queryset.order_by('-total_revenue')
@@ -0,0 +1,127 @@
+import heapq
+from collections import Counter
+from itertools import chain, islice
+
+from django.db import transaction
+
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, OrderStatusCount
+
+
+def archive_orders_batch(cutoff, batch_size=1000):
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(datetime_created__lt=cutoff)
+            .order_by('id')[:batch_size]
+        )
+        if not orders:
+            return 0
+
+        order_ids = [order.id for order in orders]
+        items = OrderItem.objects.filter(order_id__in=order_ids)
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.id,
+                customer_id=order.customer_id,
+                datetime_created=order.datetime_created,
+                status=order.status,
+                items_count=order.items_count,
+                total_amount=order.total_amount,
+            ) for order in orders
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(
+                id=item.id,
+                order_id=item.order_id,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+            ) for item in items
+        ])
+
+        items.delete()
+        Order.objects.filter(id__in=order_ids).delete()
+        OrderStatusCount.objects.adjust({status: -count for status, count in Counter(order.status for order in orders).items()})
+
+        return len(order_ids)
+
+
+def archive_orders(cutoff, batch_size=1000):
+    archived = 0
+    while True:
+        count = archive_orders_batch(cutoff, batch_size)
+        if count == 0:
+            return archived
+        archived += count
+
+
+class OrderHistory:
+    """
+    Read-only, sliceable view over the hot and archived orders of the same
+    filter, newest first by (datetime_created, id). Archived orders are
+    usually older than the hot ones, then a page is the tail of the hot tier
+    followed by the head of the archive tier. When the tiers overlap, e.g.
+    after the archive cutoff was shortened, the heads of both are merged.
+    """
+
+    ordered = True
+
+    def __init__(self, hot_queryset, archived_queryset):
+        self.tiers = [
+            hot_queryset.order_by('-datetime_created', '-id'),
+            archived_queryset.order_by('-datetime_created', '-id'),
+        ]
+        self._counts = None
+        self._overlapping = None
+
+    @staticmethod
+    def sort_key(order):
+        return order.datetime_created, order.id
+
+    def counts(self):
+        if self._counts is None:
+            self._counts = [tier.count() for tier in self.tiers]
+        return self._counts
+
+    def count(self):
+        return sum(self.counts())
+
+    def __len__(self):
+        return self.count()
+
+    def overlapping(self):
+        if self._overlapping is None:
+            hot, archived = self.tiers
+            oldest_hot = hot.values_list('datetime_created', 'id').last()
+            newest_archived = archived.values_list('datetime_created', 'id').first()
+            self._overlapping = oldest_hot is not None and newest_archived is not None \
+                and newest_archived > oldest_hot
+        return self._overlapping
+
+    def __iter__(self):
+        if self.overlapping():
+            return heapq.merge(*self.tiers, key=self.sort_key, reverse=True)
+        return chain(*self.tiers)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+
+        start, stop = key.start or 0, key.stop
+        if stop is None:
+            stop = self.count()
+
+        # any of the first stop rows of the merge is among the first stop rows of its tier
+        if self.overlapping():
+            merged = heapq.merge(*[tier[:stop] for tier in self.tiers], key=self.sort_key, reverse=True)
+            return list(islice(merged, start, stop))
+
+        result = list()
+        offset = 0
+        for tier, count in zip(self.tiers, self.counts()):
+            tier_start, tier_stop = max(start - offset, 0), min(stop - offset, count)
+            if tier_start < tier_stop:
+                result.extend(tier[tier_start:tier_stop])
+            offset += count
+        return result
@@ -0,0 +1,312 @@
+import http.client
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Category, Product, Cart, CartItem, Customer, Order, OrderItem
+from .serializers import ProductSerializer, CategorySerializer, CartSerializer, OrderForAdminSerializer, \
+    CustomerSerializer
+from .throttling import bucket_store
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessClient:
+    def __init__(self, token, index=0):
+        # a failing view is recorded as a 500 instead of stopping the run
+        self.client = Client(raise_request_exception=False)
+        self.headers = {
+            'HTTP_HOST': 'localhost',
+            # outside INTERNAL_IPS, so the debug toolbar stays out of the measurements,
+            # and one address per client like real traffic
+            'REMOTE_ADDR': f'192.0.2.{index % 254 + 1}',
+            'HTTP_AUTHORIZATION': f'JWT {token}',
+        }
+
+    def request(self, method, path, data=None):
+        counter = QueryCounter()
+        body = json.dumps(data) if data is not None else ''
+        with connection.execute_wrapper(counter):
+            response = self.client.generic(method, path, body, content_type='application/json', **self.headers)
+        return response.status_code, response.content, counter.count
+
+    def close(self):
+        connection.close()
+
+
+class HTTPClient:
+    def __init__(self, token, base_url):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.netloc, timeout=30)
+        self.prefix = url.path.rstrip('/')
+        self.headers = {'Authorization': f'JWT {token}', 'Content-Type': 'application/json'}
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data) if data is not None else None
+        self.connection.request(method, self.prefix + path, body=body, headers=self.headers)
+        response = self.connection.getresponse()
+        # queries are only visible in-process
+        return response.status, response.read(), None
+
+    def close(self):
+        self.connection.close()
+
+
+def fill_cart(value, cart_id):
+    if isinstance(value, str):
+        return value.replace('{cart_id}', str(cart_id))
+    if isinstance(value, dict):
+        return {key: fill_cart(item, cart_id) for key, item in value.items()}
+    return value
+
+
+class BenchmarkClient:
+    def __init__(self, client):
+        self.client = client
+        self.cart_id = None
+
+    def new_cart(self):
+        status, content, _ = self.client.request('POST', '/carts/', {})
+        self.cart_id = json.loads(content)['id'] if status == 201 else None
+
+    def run(self, request):
+        if '{cart_id}' in json.dumps(request) and self.cart_id is None:
+            self.new_cart()
+        path, data = fill_cart(request['path'], self.cart_id), fill_cart(request.get('data'), self.cart_id)
+
+        started = time.perf_counter()
+        status, _, queries = self.client.request(request['method'], path, data)
+        elapsed = time.perf_counter() - started
+
+        # a successful checkout deletes the cart
+        if request['name'] == 'checkout' and status < 400:
+            self.cart_id = None
+        return elapsed, status, queries
+
+
+def run_benchmark(requests, users, concurrency=8, base_url=None, warmup=0):
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    tokens = [str(AccessToken.for_user(user)) for user in users]
+
+    def worker(index):
+        token = tokens[index % len(tokens)]
+        client = BenchmarkClient(HTTPClient(token, base_url) if base_url else InProcessClient(token, index))
+        try:
+            for number, request in enumerate(requests[index::concurrency]):
+                elapsed, status, queries = client.run(request)
+                if number * concurrency + index < warmup:
+                    continue
+                with lock:
+                    samples[request['name']].append((elapsed, status, queries))
+        finally:
+            client.client.close()
+
+    # the throttles would turn the write requests into 429s, the run measures the endpoints
+    throttles = override_settings(TOKEN_BUCKET_RATES={}) if not base_url else nullcontext()
+    with throttles:
+        bucket_store.clear()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+        duration = time.perf_counter() - started
+
+    return summarize(samples, duration)
+
+
+def summarize_samples(samples, duration):
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    statuses = defaultdict(int)
+    for _, status, _ in samples:
+        statuses[str(status)] += 1
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'throughput': round(len(samples) / duration, 2) if duration else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'statuses': dict(statuses),
+    }
+
+
+def summarize(samples, duration):
+    everything = [sample for name_samples in samples.values() for sample in name_samples]
+    return {
+        'duration_s': round(duration, 2),
+        'total': summarize_samples(everything, duration),
+        'endpoints': {name: summarize_samples(name_samples, duration) for name, name_samples in sorted(samples.items())},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def block_queries(execute, sql, params, many, context):
+    raise RuntimeError(f'serializer benchmarks must not touch the database: {sql}')
+
+
+def prefetched(instance, name, objects):
+    # what prefetch_related leaves behind, related managers read it instead of querying
+    instance._prefetched_objects_cache = {name: objects}
+    return instance
+
+
+def build_products(rng, size, categories=10):
+    categories = [Category(id=i, title=f'category {i}') for i in range(1, categories + 1)]
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [Product(
+        id=i, name=f'product {i}', description='a product ' * 20, category=rng.choice(categories), slug=f'product-{i}',
+        unit_price=Decimal(rng.randint(100, 100000)) / 100, inventory=rng.randint(1, 100), datetime_created=created,
+    ) for i in range(1, size + 1)]
+
+
+def build_categories(rng, size):
+    categories = [Category(id=i, title=f'category {i}', description='a category') for i in range(1, size + 1)]
+    for category in categories:
+        category.number_of_products = rng.randint(0, 500)
+    return categories
+
+
+def build_carts(rng, size, items=5):
+    products = build_products(rng, 100)
+    carts = list()
+    for i in range(size):
+        cart = Cart(id=UUID(int=rng.getrandbits(128), version=4), items_count=items)
+        carts.append(prefetched(cart, 'items', [
+            CartItem(id=i * items + n, cart=cart, product=product, quantity=rng.randint(1, 5))
+            for n, product in enumerate(rng.sample(products, items))
+        ]))
+    return carts
+
+
+def build_customers(rng, size):
+    User = get_user_model()
+    return [Customer(
+        id=i, user=User(id=i, username=f'user{i}', first_name='First', last_name='Last'), phone_number='0912000000',
+        email=f'user{i}@example.com', orders_count=rng.randint(0, 50), total_spent=Decimal(rng.randint(0, 10 ** 6)) / 100,
+        last_order_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    ) for i in range(1, size + 1)]
+
+
+def build_orders(rng, size, items=5):
+    products = build_products(rng, 100)
+    customers = build_customers(rng, 50)
+    orders = list()
+    for i in range(1, size + 1):
+        order = Order(id=i, customer=rng.choice(customers), status=Order.ORDER_STATUS_PAID, items_count=items)
+        order_items = [
+            OrderItem(id=i * items + n, order=order, product=product, quantity=rng.randint(1, 5), unit_price=product.unit_price)
+            for n, product in enumerate(rng.sample(products, items))
+        ]
+        order.total_amount = sum(item.quantity * item.unit_price for item in order_items)
+        orders.append(prefetched(order, 'items', order_items))
+    return orders
+
+
+SERIALIZER_BENCHMARKS = {
+    'ProductSerializer': (ProductSerializer, build_products),
+    'CategorySerializer': (CategorySerializer, build_categories),
+    'CartSerializer': (CartSerializer, build_carts),
+    'OrderForAdminSerializer': (OrderForAdminSerializer, build_orders),
+    'CustomerSerializer': (CustomerSerializer, build_customers),
+}
+
+
+def measure_serializer(serializer_class, objects, repeat=5):
+    timings = list()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        serializer_class(objects, many=True).data
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        data = serializer_class(objects, many=True).data
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        retained = [stat for stat in tracemalloc.take_snapshot().compare_to(before, 'filename') if stat.count_diff > 0]
+    finally:
+        tracemalloc.stop()
+    del data
+
+    return {
+        'objects_per_s': round(len(objects) / best, 1),
+        'best_ms': round(best * 1000, 3),
+        'median_ms': round(sorted(timings)[len(timings) // 2] * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+        'retained_blocks': sum(stat.count_diff for stat in retained),
+        'retained_kb': round(sum(stat.size_diff for stat in retained) / 1024, 1),
+    }
+
+
+def measure_fields(serializer_class, objects):
+    # the cost of every top level field on its own: attribute lookup plus to_representation
+    fields = dict()
+    for name, field in serializer_class(objects, many=True).child.fields.items():
+        if field.write_only:
+            continue
+        started = time.perf_counter()
+        for instance in objects:
+            attribute = field.get_attribute(instance)
+            if attribute is not None:
+                field.to_representation(attribute)
+        fields[name] = round((time.perf_counter() - started) / len(objects) * 10 ** 6, 2)
+    return fields
+
+
+def run_serializer_benchmarks(names, sizes, repeat=5, fields=False, seed=0):
+    results = dict()
+    with connection.execute_wrapper(block_queries):
+        for name in names:
+            serializer_class, build = SERIALIZER_BENCHMARKS[name]
+            results[name] = dict()
+            for size in sizes:
+                objects = build(random.Random(f'{seed}:{name}:{size}'), size)
+                result = measure_serializer(serializer_class, objects, repeat)
+                if fields:
+                    result['field_us'] = measure_fields(serializer_class, objects)
+                results[name][str(size)] = result
+    return results
@@ -0,0 +1,153 @@
+import traceback
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import F, Max, Min, Q
+from django.http import HttpRequest, QueryDict
+from django.urls import reverse
+from django.utils import timezone
+
+from .analytics import track_order_sales
+from .cache import object_cache
+from .models import AdminBulkJob, Customer, Order, Product, OrderItem
+
+
+BULK_ACTIONS = dict()
+CHUNK_SIZE = 5000
+STALE_AFTER = timedelta(minutes=10)
+
+
+def bulk_action(name, model):
+    def register(function):
+        BULK_ACTIONS[name] = (model, function)
+        return function
+    return register
+
+
+@bulk_action('clear_inventory', Product)
+def clear_inventory(queryset):
+    product_ids = list(queryset.values_list('id', flat=True))
+    update_count = queryset.update(inventory=0)
+    transaction.on_commit(lambda: object_cache.invalidate('product', *product_ids))
+    return update_count
+
+
+@bulk_action('clear_quantity', OrderItem)
+def clear_quantity(queryset):
+    order_ids = list(queryset.values_list('order_id', flat=True).distinct())
+    with track_order_sales(order_ids):
+        update_count = queryset.update(quantity=0)
+
+    orders = Order.objects.filter(pk__in=order_ids)
+    Order.objects.refresh_totals(orders)
+    Customer.objects.refresh_order_stats(Customer.objects.filter(pk__in=orders.values('customer_id')))
+    return update_count
+
+
+def queue_job(action, queryset, user=None, changelist_query=None):
+    """
+    Queues action over the selected rows of queryset, or with changelist_query, over
+    every row the changelist of those filters shows. Only the pk bounds are read here,
+    the rows are found chunk by chunk by the worker.
+    """
+    model = queryset.model
+    if changelist_query is None:
+        object_ids = list(queryset.values_list('pk', flat=True))
+        bounds = {'first': min(object_ids, default=None), 'last': max(object_ids, default=None)}
+    else:
+        object_ids = None
+        # the bounds of the whole table are two index lookups, those of the filtered rows may be a scan
+        bounds = model._default_manager.aggregate(first=Min('pk'), last=Max('pk'))
+
+    return AdminBulkJob.objects.create(
+        action=action,
+        model_label=model._meta.label,
+        object_ids=object_ids,
+        changelist_query=changelist_query or '',
+        first_pk=bounds['first'],
+        last_pk=bounds['last'],
+        created_by=user,
+    )
+
+
+def job_queryset(job):
+    model = apps.get_model(job.model_label)
+    if job.object_ids is not None:
+        return model._default_manager.filter(pk__in=job.object_ids)
+
+    # the same filters and search the changelist applied in the admin request
+    path = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+    request = HttpRequest()
+    request.method, request.path, request.GET = 'GET', path, QueryDict(job.changelist_query)
+    request.user = job.created_by or AnonymousUser()
+    model_admin = admin.site.get_model_admin(model)
+    return model_admin.get_changelist_instance(request).get_queryset(request).order_by()
+
+
+def job_chunks(job, chunk_size=CHUNK_SIZE):
+    if job.first_pk is None:
+        return []
+    queryset = job_queryset(job)
+    return [
+        queryset.filter(pk__gt=low, pk__lte=min(low + chunk_size, job.last_pk))
+        for low in range(job.first_pk - 1, job.last_pk, chunk_size)
+    ]
+
+
+def run_job(job, chunk_size=CHUNK_SIZE):
+    _, function = BULK_ACTIONS[job.action]
+    chunks = job_chunks(job, chunk_size)
+
+    AdminBulkJob.objects.filter(pk=job.pk).update(
+        status=AdminBulkJob.JOB_STATUS_RUNNING, total_chunks=len(chunks),
+        datetime_started=job.datetime_started or timezone.now(), datetime_heartbeat=timezone.now(),
+    )
+
+    try:
+        # a reclaimed job carries on after the chunks its previous worker committed
+        for chunk in chunks[job.done_chunks:]:
+            if AdminBulkJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+                AdminBulkJob.objects.filter(pk=job.pk).update(
+                    status=AdminBulkJob.JOB_STATUS_CANCELED, datetime_finished=timezone.now(),
+                )
+                return
+
+            # one short transaction per chunk keeps row locks brief
+            with transaction.atomic():
+                rows = function(chunk)
+                AdminBulkJob.objects.filter(pk=job.pk).update(
+                    done_chunks=F('done_chunks') + 1, rows_affected=F('rows_affected') + rows,
+                    datetime_heartbeat=timezone.now(),
+                )
+    except Exception:
+        AdminBulkJob.objects.filter(pk=job.pk).update(
+            status=AdminBulkJob.JOB_STATUS_FAILED, error=traceback.format_exc(), datetime_finished=timezone.now(),
+        )
+        return
+
+    AdminBulkJob.objects.filter(pk=job.pk).update(
+        status=AdminBulkJob.JOB_STATUS_DONE, datetime_finished=timezone.now(),
+    )
+
+
+def claim_next_job(stale_after=STALE_AFTER):
+    with transaction.atomic():
+        # running jobs without a heartbeat for stale_after lost their worker
+        job = AdminBulkJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=AdminBulkJob.JOB_STATUS_QUEUED) |
+            Q(status=AdminBulkJob.JOB_STATUS_RUNNING, datetime_heartbeat__lt=timezone.now() - stale_after)
+        ).order_by('id').first()
+        if job is None:
+            return None
+        if job.cancel_requested:
+            job.status = AdminBulkJob.JOB_STATUS_CANCELED
+            job.datetime_finished = timezone.now()
+            job.save(update_fields=['status', 'datetime_finished'])
+            return job
+        job.status = AdminBulkJob.JOB_STATUS_RUNNING
+        job.datetime_heartbeat = timezone.now()
+        job.save(update_fields=['status', 'datetime_heartbeat'])
+        return job
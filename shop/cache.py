@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+class TieredCache:
+    """
+    Objects cached in an in-process LRU in front of a shared django cache.
+
+    Keys are versioned per namespace, so a whole namespace is dropped by bumping
+    its version. Invalidations are appended to a numbered log in the shared cache,
+    which every process replays at most sync_interval seconds later to evict its
+    own copies.
+    """
+
+    def __init__(self, alias='default', local_size=10000, local_ttl=30, ttls=None, default_ttl=300,
+                 sync_interval=1.0, schema=1, prefix='objects', log_ttl=300, max_replay=1000, max_keys=100):
+        self.alias = alias
+        self.local = LRUCache(local_size, local_ttl)
+        self.ttls = ttls or dict()
+        self.default_ttl = default_ttl
+        self.sync_interval = sync_interval
+        # bumped when the cached models change shape, old entries are ignored from then on
+        self.schema = schema
+        self.prefix = prefix
+        self.log_ttl = log_ttl
+        self.max_replay = max_replay
+        self.max_keys = max_keys
+
+        self.versions = dict()
+        self.seen = None
+        self.synced_at = None
+        self.sync_lock = threading.Lock()
+        self.counters = defaultdict(lambda: {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0})
+        self.resets = 0
+
+    def shared(self):
+        return caches[self.alias]
+
+    def ttl(self, namespace):
+        return self.ttls.get(namespace, self.default_ttl)
+
+    def shared_key(self, namespace, key):
+        return f'{self.prefix}:{self.schema}:{namespace}:{key}'
+
+    def version_key(self, namespace):
+        return f'{self.prefix}:version:{namespace}'
+
+    def log_key(self, number=None):
+        return f'{self.prefix}:invalidations' if number is None else f'{self.prefix}:invalidations:{number}'
+
+    def version(self, namespace):
+        version = self.versions.get(namespace)
+        if version is None:
+            version = self.shared().get(self.version_key(namespace)) or 1
+            self.versions[namespace] = version
+        return version
+
+    def get_or_load(self, namespace, key, loader):
+        """The cached object, or the result of loader() which is cached unless it is None."""
+        self.sync()
+        key = str(key)
+        counters = self.counters[namespace]
+
+        value = self.local.get((namespace, key))
+        if value is not None:
+            counters['local_hits'] += 1
+            return value
+
+        version = self.version(namespace)
+        value = self.shared().get(self.shared_key(namespace, key), version=version)
+        if value is not None:
+            counters['shared_hits'] += 1
+        else:
+            counters['misses'] += 1
+            value = loader()
+            if value is None:
+                return None
+            self.shared().set(self.shared_key(namespace, key), value, timeout=self.ttl(namespace), version=version)
+
+        self.local.set((namespace, key), value, ttl=min(self.local.ttl, self.ttl(namespace)))
+        return value
+
+    def invalidate(self, namespace, *keys):
+        if not keys:
+            return
+        # cheaper to drop the namespace than to broadcast a long list of keys
+        if len(keys) > self.max_keys:
+            return self.invalidate_namespace(namespace)
+
+        keys = tuple(str(key) for key in keys)
+        for key in keys:
+            self.local.invalidate((namespace, key))
+        self.shared().delete_many([self.shared_key(namespace, key) for key in keys], version=self.version(namespace))
+        self.broadcast(namespace, keys)
+        self.counters[namespace]['invalidations'] += len(keys)
+
+    def invalidate_namespace(self, namespace):
+        self.versions[namespace] = self.incr(self.version_key(namespace), initial=1)
+        self.drop_namespace(namespace)
+        self.broadcast(namespace, None)
+        self.counters[namespace]['invalidations'] += 1
+
+    def drop_namespace(self, namespace):
+        self.local.invalidate_where(lambda key: key[0] == namespace)
+
+    def invalidate_all(self):
+        for namespace in {*self.ttls, *self.counters}:
+            self.invalidate_namespace(namespace)
+
+    def incr(self, key, initial=0):
+        shared = self.shared()
+        shared.add(key, initial, timeout=None)
+        try:
+            return shared.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            shared.set(key, initial + 1, timeout=None)
+            return initial + 1
+
+    def broadcast(self, namespace, keys):
+        # keys None stands for the whole namespace
+        self.shared().set(self.log_key(self.incr(self.log_key())), (namespace, keys), timeout=self.log_ttl)
+
+    def sync(self):
+        now = time.monotonic()
+        if self.synced_at is not None and now - self.synced_at < self.sync_interval:
+            return
+        # one thread replays the log, the others carry on with what they have
+        if not self.sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.synced_at = now
+            shared = self.shared()
+            latest = shared.get(self.log_key()) or 0
+            if self.seen is None or latest == self.seen:
+                self.seen = latest
+                return
+
+            numbers = range(self.seen + 1, latest + 1)
+            entries = shared.get_many([self.log_key(number) for number in numbers]) \
+                if 0 < len(numbers) <= self.max_replay else dict()
+            # a reset counter, a process too far behind or expired entries, start over
+            if len(entries) < len(numbers) or not numbers:
+                self.reset()
+            else:
+                for namespace, keys in entries.values():
+                    if keys is None:
+                        self.versions.pop(namespace, None)
+                        self.drop_namespace(namespace)
+                    else:
+                        for key in keys:
+                            self.local.invalidate((namespace, key))
+            self.seen = latest
+        finally:
+            self.sync_lock.release()
+
+    def reset(self):
+        self.local.clear()
+        self.versions.clear()
+        self.resets += 1
+
+    def clear(self):
+        # this process only, used between tests
+        self.reset()
+        self.seen = None
+        self.synced_at = None
+        self.counters.clear()
+        self.resets = 0
+
+    def stats(self):
+        namespaces = dict()
+        for namespace, counters in list(self.counters.items()):
+            lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+            hits = counters['local_hits'] + counters['shared_hits']
+            namespaces[namespace] = {**counters, 'hit_rate': round(hits / lookups, 4) if lookups else None}
+        return {
+            'pid': os.getpid(),
+            'local': self.local.stats(),
+            'namespaces': namespaces,
+            'invalidations_seen': self.seen,
+            'resets': self.resets,
+        }
+
+
+object_cache = TieredCache(
+    alias=getattr(settings, 'OBJECT_CACHE', 'default'),
+    local_size=getattr(settings, 'OBJECT_CACHE_LOCAL_SIZE', 10000),
+    local_ttl=getattr(settings, 'OBJECT_CACHE_LOCAL_TTL', 30),
+    ttls=getattr(settings, 'OBJECT_CACHE_TTLS', None),
+    sync_interval=getattr(settings, 'OBJECT_CACHE_SYNC_INTERVAL', 1.0),
+    schema=getattr(settings, 'OBJECT_CACHE_SCHEMA', 1),
+)
@@ -0,0 +1,29 @@
+from django.db.backends.mysql import base
+
+from shop.pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """MySQL backend that keeps closed connections in a per-process pool, configured by OPTIONS['pool']."""
+
+    @property
+    def pool(self):
+        options = self.settings_dict['OPTIONS'].get('pool', {})
+        return get_pool(self.alias, check=lambda connection: connection.ping(), **options)
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # a connection in the middle of a transaction or after an error is not handed out again
+        if self.in_atomic_block or not self.autocommit or self.errors_occurred:
+            self.pool.discard(self.connection)
+        else:
+            self.pool.release(self.connection)
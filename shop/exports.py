@@ -0,0 +1,119 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import chain
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.utils import timezone
+
+from .models import OrderItem, ArchivedOrderItem
+
+
+ORDER_EXPORT_FIELDS = [
+    ('order_id', 'order_id'),
+    ('datetime_created', 'order__datetime_created'),
+    ('status', 'order__status'),
+    ('customer_id', 'order__customer_id'),
+    ('first_name', 'order__customer__user__first_name'),
+    ('last_name', 'order__customer__user__last_name'),
+    ('email', 'order__customer__email'),
+    ('product_id', 'product_id'),
+    ('product_name', 'product__name'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'unit_price'),
+]
+ORDER_EXPORT_COLUMNS = [column for column, _ in ORDER_EXPORT_FIELDS] + ['line_total']
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def order_lines_queryset(model=OrderItem, start=None, end=None, status=None):
+    queryset = model.objects.all()
+    # bounds on the column itself, __date wraps it in DATE(CONVERT_TZ(...)) and skips its index
+    if start:
+        queryset = queryset.filter(order__datetime_created__gte=day_start(start))
+    if end:
+        queryset = queryset.filter(order__datetime_created__lt=day_start(end + timedelta(days=1)))
+    if status:
+        queryset = queryset.filter(order__status=status)
+    return queryset.order_by('order_id', 'id').values_list(*[lookup for _, lookup in ORDER_EXPORT_FIELDS])
+
+
+def stream_queryset(queryset, chunk_size=2000):
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    # mysqlclient buffers the whole result set client-side by default,
+    # an SSCursor fetches rows from the server as they are consumed.
+    from MySQLdb.cursors import SSCursor
+
+    compiler = queryset.query.get_compiler(using=queryset.db)
+    try:
+        sql, params = compiler.as_sql()
+    except EmptyResultSet:
+        return
+    # the raw cursor skips django's converters, e.g. datetimes would come back naive
+    converters = compiler.get_converters([select[0] for select in compiler.select[:compiler.col_count]])
+
+    connection.ensure_connection()
+    cursor = connection.connection.cursor(SSCursor)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if converters:
+                rows = map(tuple, compiler.apply_converters(rows, converters))
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def iterate_in_chunks(queryset, chunk_size=2000):
+    # keyset pagination on the primary key, every chunk is a short indexed range query
+    # so neither the database driver nor python ever holds more than one chunk.
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        objects = list(chunk[:chunk_size])
+        if not objects:
+            break
+        yield from objects
+        last_pk = objects[-1].pk
+
+
+def order_export_rows(start=None, end=None, status=None, include_archived=False):
+    models = [OrderItem, ArchivedOrderItem] if include_archived else [OrderItem]
+    for row in chain(*[stream_queryset(order_lines_queryset(model, start, end, status)) for model in models]):
+        quantity, unit_price = row[-2], row[-1]
+        yield (*row, quantity * unit_price)
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_csv(rows, columns=ORDER_EXPORT_COLUMNS):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(ORDER_EXPORT_COLUMNS, row)), default=str) + '\n'
+
+
+EXPORT_RENDERERS = {
+    'csv': (render_csv, 'text/csv'),
+    'ndjson': (render_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,310 @@
+import math
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from uuid import UUID
+
+from faker import Faker
+
+
+FAKE_USERNAME_PREFIX = 'fake-user-'
+FAKE_DATA_START = datetime(2019, 1, 1, tzinfo=timezone.utc)
+FAKE_DATA_END = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+# relative traffic by month, hour of day and weekday (monday first), peaking in the end of year sales and the evenings
+MONTH_WEIGHTS = (0.8, 0.7, 0.85, 0.9, 0.95, 0.9, 0.85, 0.9, 0.95, 1.05, 1.5, 1.8)
+HOUR_WEIGHTS = (0.3, 0.2, 0.15, 0.1, 0.1, 0.15, 0.3, 0.5, 0.7, 0.8, 0.9, 1.0,
+                1.1, 1.0, 0.9, 0.9, 1.0, 1.1, 1.3, 1.5, 1.6, 1.4, 1.0, 0.6)
+WEEKDAY_WEIGHTS = (1.0, 0.95, 0.95, 1.0, 1.1, 1.3, 1.2)
+MAX_SEASONAL_WEIGHT = max(MONTH_WEIGHTS) * max(HOUR_WEIGHTS) * max(WEEKDAY_WEIGHTS)
+
+DEFAULT_REQUEST_MIX = {
+    'product_list': 25,
+    'product_detail': 30,
+    'category_products': 10,
+    'category_list': 5,
+    'product_comments': 10,
+    'cart_add': 12,
+    'checkout': 3,
+    'order_list': 5,
+}
+
+faker = Faker()
+
+
+def chunk_random(seed, phase, start):
+    # every chunk gets its own generator, so the output depends on the seed and
+    # the batch size but not on the number of workers or the order chunks finish in
+    chunk_seed = f'{seed}:{phase}:{start}'
+    faker.seed_instance(chunk_seed)
+    return random.Random(chunk_seed)
+
+
+def random_datetime(rng, start=FAKE_DATA_START, end=FAKE_DATA_END):
+    return start + timedelta(seconds=rng.randrange(int((end - start).total_seconds())))
+
+
+def seasonal_datetime(rng, start=FAKE_DATA_START, end=FAKE_DATA_END):
+    while True:
+        value = random_datetime(rng, start, end)
+        weight = MONTH_WEIGHTS[value.month - 1] * HOUR_WEIGHTS[value.hour] * WEEKDAY_WEIGHTS[value.weekday()]
+        if rng.random() * MAX_SEASONAL_WEIGHT < weight:
+            return value
+
+
+def zipf_rank(rng, n, exponent):
+    # inverse cdf of a continuous power law over [1, n], exponent 0 is uniform
+    u = rng.random()
+    if abs(exponent - 1) < 1e-9:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - exponent) - 1) * u + 1) ** (1 / (1 - exponent))
+    return min(n, max(1, int(rank)))
+
+
+class PopularitySampler:
+    def __init__(self, n, exponent=1.0, hot_fraction=0.0, hot_share=0.0, seed=0):
+        self.n = n
+        self.exponent = exponent
+        self.hot_size = max(1, int(n * hot_fraction)) if hot_fraction and hot_share else 0
+        self.hot_share = hot_share
+
+        # spread the ranks over the ids with a fixed permutation, otherwise
+        # the oldest rows would always be the most popular ones
+        rng = random.Random(f'{seed}:popularity:{n}')
+        self.step = 1
+        if n > 2:
+            self.step = rng.randrange(1, n)
+            while math.gcd(self.step, n) != 1:
+                self.step = rng.randrange(1, n)
+        self.offset = rng.randrange(n) if n else 0
+
+    def rank(self, rng):
+        if self.hot_size and rng.random() < self.hot_share:
+            return rng.randint(1, self.hot_size)
+        return zipf_rank(rng, self.n, self.exponent)
+
+    def id_of(self, rank):
+        return ((rank - 1) * self.step + self.offset) % self.n + 1
+
+    def rank_of(self, object_id):
+        return ((object_id - 1 - self.offset) * pow(self.step, -1, self.n)) % self.n + 1
+
+    def sample(self, rng):
+        if not self.n:
+            raise ValueError("Cannot sample from an empty range.")
+        return self.id_of(self.rank(rng))
+
+    def sample_distinct(self, rng, k):
+        k = min(k, self.n)
+        picked = dict()
+        for _ in range(k * 20):
+            if len(picked) == k:
+                break
+            picked[self.sample(rng)] = None
+        # a very skewed distribution keeps drawing the same few ids
+        while len(picked) < k:
+            picked[rng.randint(1, self.n)] = None
+        return list(picked)
+
+
+def add_popularity_arguments(parser):
+    parser.add_argument('--product-skew', type=float, default=1.1, help='zipf exponent of product popularity, 0 is uniform')
+    parser.add_argument('--category-skew', type=float, default=1.0, help='zipf exponent of category sizes')
+    parser.add_argument('--customer-skew', type=float, default=0.8, help='zipf exponent of orders per customer')
+    parser.add_argument('--hot-fraction', type=float, default=0.01, help='fraction of the products in the hot set')
+    parser.add_argument('--hot-share', type=float, default=0.2, help='share of the product picks going to the hot set')
+
+
+def popularity_samplers(seed, options, products, categories, customers=0):
+    return {
+        'products': PopularitySampler(products, options['product_skew'], options['hot_fraction'], options['hot_share'], seed),
+        'categories': PopularitySampler(categories, options['category_skew'], seed=seed),
+        'customers': PopularitySampler(customers, options['customer_skew'], seed=seed),
+    }
+
+
+def product_price(seed, product_id):
+    rng = random.Random(f'{seed}:price:{product_id}')
+    return Decimal(rng.randint(100, 100000)) / 100
+
+
+def generate_categories(seed, start, count, context):
+    chunk_random(seed, 'categories', start)
+    return [{
+        'id': category_id,
+        'title': faker.sentence(nb_words=5)[:200],
+        'description': faker.paragraph(nb_sentences=1),
+    } for category_id in range(start + 1, start + count + 1)]
+
+
+def generate_discounts(seed, start, count, context):
+    rng = chunk_random(seed, 'discounts', start)
+    return [{
+        'id': discount_id,
+        'discount': rng.randint(1, 80) / 100,
+        'description': faker.paragraph(nb_sentences=1),
+    } for discount_id in range(start + 1, start + count + 1)]
+
+
+def generate_products(seed, start, count, context):
+    rng = chunk_random(seed, 'products', start)
+    products = list()
+    for product_id in range(start + 1, start + count + 1):
+        name = ' '.join(word.capitalize() for word in faker.words(3))
+        datetime_created = random_datetime(rng)
+        products.append({
+            'id': product_id,
+            'name': name,
+            'slug': '-'.join(name.split(' ')).lower()[:50],
+            'description': faker.paragraph(nb_sentences=5),
+            'category_id': context['categories'].sample(rng),
+            'unit_price': product_price(seed, product_id),
+            'inventory': rng.randint(1, 100),
+            'datetime_created': datetime_created,
+            'datetime_modified': datetime_created + timedelta(hours=rng.randint(1, 500)),
+        })
+    return products
+
+
+def generate_customers(seed, start, count, context):
+    rng = chunk_random(seed, 'customers', start)
+    users, customers, addresses = list(), list(), list()
+    for customer_id in range(start + 1, start + count + 1):
+        user_id = context['first_user_id'] + customer_id - 1
+        users.append({
+            'id': user_id,
+            'username': f'{FAKE_USERNAME_PREFIX}{customer_id}',
+            'password': context['password'],
+            'first_name': faker.first_name(),
+            'last_name': faker.last_name(),
+            'email': faker.email(),
+        })
+        customers.append({
+            'id': customer_id,
+            'user_id': user_id,
+            'email': faker.email(),
+            'phone_number': faker.phone_number(),
+            'birth_date': faker.date_between(datetime(1990, 1, 1), datetime(2015, 1, 1)) if rng.random() > 0.3 else None,
+        })
+        addresses.append({
+            'customer_id': customer_id,
+            'province': faker.word(),
+            'city': faker.word(),
+            'address_detail': f'street {rng.randint(1, 50)}',
+        })
+    return users, customers, addresses
+
+
+def generate_orders(seed, start, count, context):
+    rng = chunk_random(seed, 'orders', start)
+    orders, items = list(), list()
+    for order_id in range(start + 1, start + count + 1):
+        product_ids = context['products'].sample_distinct(rng, rng.randint(1, context['items_per_order']))
+        order_items = [{
+            'order_id': order_id,
+            'product_id': product_id,
+            'quantity': rng.randint(1, 20),
+            'unit_price': product_price(seed, product_id),
+        } for product_id in product_ids]
+        orders.append({
+            'id': order_id,
+            'customer_id': context['customers'].sample(rng),
+            'datetime_created': seasonal_datetime(rng),
+            'status': rng.choice(context['statuses']),
+            'items_count': len(order_items),
+            'total_amount': sum(item['quantity'] * item['unit_price'] for item in order_items),
+        })
+        items.extend(order_items)
+    return orders, items
+
+
+def generate_comments(seed, start, count, context):
+    rng = chunk_random(seed, 'comments', start)
+    comments = list()
+    products = context['products']
+    for product_id in range(start + 1, start + count + 1):
+        # pareto distributed counts, scaled up for the popular products
+        weight = 1 + math.log(products.n / products.rank_of(product_id))
+        for _ in range(min(context['comments_per_product'], int(rng.paretovariate(context['comment_tail']) * weight) - 1)):
+            comments.append({
+                'product_id': product_id,
+                'name': faker.first_name(),
+                'body': faker.paragraph(nb_sentences=3),
+                'status': rng.choice(context['statuses']),
+                'datetime_created': seasonal_datetime(rng),
+            })
+    return comments
+
+
+def generate_carts(seed, start, count, context):
+    rng = chunk_random(seed, 'carts', start)
+    carts, items = list(), list()
+    for _ in range(count):
+        cart_id = UUID(int=rng.getrandbits(128), version=4)
+        product_ids = context['products'].sample_distinct(rng, rng.randint(1, context['items_per_cart']))
+        carts.append({
+            'id': cart_id,
+            'created_at': seasonal_datetime(rng, start=context['now'] - timedelta(days=30), end=context['now']),
+            'items_count': len(product_ids),
+        })
+        items.extend({'cart_id': cart_id, 'product_id': product_id, 'quantity': rng.randint(1, 20)} for product_id in product_ids)
+    return carts, items
+
+
+def request_mix(seed, products, categories, count, mix=DEFAULT_REQUEST_MIX, page_size=10):
+    # '{cart_id}' in a path or body is the cart of the client replaying the request
+    rng = random.Random(f'{seed}:requests')
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    pages = PopularitySampler(max(1, products.n // page_size), exponent=1.5)
+
+    for name in rng.choices(names, weights, k=count):
+        if name == 'product_list':
+            page = pages.rank(rng)
+            request = {'method': 'GET', 'path': f'/products/?page={page}' if page > 1 else '/products/'}
+        elif name == 'product_detail':
+            request = {'method': 'GET', 'path': f'/products/{products.sample(rng)}/'}
+        elif name == 'category_products':
+            request = {'method': 'GET', 'path': f'/products/?category={categories.sample(rng)}'}
+        elif name == 'category_list':
+            request = {'method': 'GET', 'path': '/category/'}
+        elif name == 'product_comments':
+            request = {'method': 'GET', 'path': f'/products/{products.sample(rng)}/comments/'}
+        elif name == 'cart_add':
+            request = {'method': 'POST', 'path': '/carts/{cart_id}/items/',
+                       'data': {'product': products.sample(rng), 'quantity': rng.randint(1, 3)}}
+        elif name == 'checkout':
+            request = {'method': 'POST', 'path': '/orders/', 'data': {'cart_id': '{cart_id}'}}
+        elif name == 'order_list':
+            request = {'method': 'GET', 'path': '/orders/'}
+        else:
+            raise ValueError(f'unknown request {name}')
+        yield {'name': name, **request}
+
+
+def run_chunk(spec):
+    generator, seed, start, count, context = spec
+    return generator(seed, start, count, context)
+
+
+def generate_in_chunks(generator, total, seed, context, batch_size=5000, workers=None):
+    workers = workers or os.cpu_count() or 1
+    specs = [(generator, seed, start, min(batch_size, total - start), context) for start in range(0, total, batch_size)]
+    if workers == 1 or len(specs) < 2:
+        yield from map(run_chunk, specs)
+        return
+
+    # only a few chunks are in flight at a time, so memory stays bounded
+    # even when inserting is slower than generating
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for spec in specs:
+            pending.append(executor.submit(run_chunk, spec))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
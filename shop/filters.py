@@ -1,4 +1,5 @@
-from .models import Product
+from .models import Product, Customer
+from .search import search_customers
 
 from django_filters import rest_framework as filters
 
@@ -14,3 +15,18 @@ class ProductFilter(filters.FilterSet):
     # def filter_by_category(self, queryset, name, value):
     #     return queryset.filter(category__title=value)
 
+
+
+
+class CustomerFilter(filters.FilterSet):
+    class Meta:
+        model = Customer
+        fields = []
+
+    orders_count = filters.RangeFilter(field_name='orders_count', label='enter orders_count range')
+    total_spent = filters.RangeFilter(field_name='total_spent', label='enter total_spent range')
+    last_order_at = filters.DateFromToRangeFilter(field_name='last_order_at', label='enter last_order_at range')
+    q = filters.CharFilter(method='search', label='name, email or phone number')
+
+    def search(self, queryset, name, value):
+        return search_customers(queryset, value)
@@ -0,0 +1,104 @@
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from .models import EmailJob
+
+
+def queue_emails(customers, subject, body):
+    recipients = customers.annotate(
+        to_email=Coalesce(NullIf('email', Value('')), NullIf('user__email', Value('')))
+    ).filter(to_email__isnull=False).values_list('id', 'to_email')
+
+    jobs = EmailJob.objects.bulk_create([
+        EmailJob(customer_id=customer_id, to_email=to_email, subject=subject, body=body)
+        for customer_id, to_email in recipients.iterator(chunk_size=2000)
+    ], batch_size=1000)
+    return len(jobs)
+
+
+def claim_pending_jobs(batch_size):
+    with transaction.atomic():
+        jobs = list(
+            EmailJob.objects.select_for_update(skip_locked=True)
+            .filter(status=EmailJob.EMAIL_STATUS_PENDING, next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        # push the claimed jobs forward so a parallel worker does not pick them up again
+        EmailJob.objects.filter(pk__in=[job.pk for job in jobs]) \
+            .update(next_attempt_at=timezone.now() + timedelta(minutes=10))
+    return jobs
+
+
+def connection_lost(error):
+    # smtplib errors are OSErrors too, but most of them are about one message
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def deliver_batch(batch_size=None, rate_limit=None, max_attempts=None):
+    batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+    # 0 turns the rate limit off
+    rate_limit = settings.EMAIL_QUEUE_RATE_LIMIT if rate_limit is None else rate_limit
+    max_attempts = max_attempts or settings.EMAIL_QUEUE_MAX_ATTEMPTS
+
+    jobs = claim_pending_jobs(batch_size)
+    if not jobs:
+        return {'sent': 0, 'failed': 0, 'unattempted': 0}
+
+    sent, failed, unattempted = list(), list(), list()
+    started_at = time.monotonic()
+    # one SMTP connection for the whole batch
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as error:
+        # the claimed jobs were pushed forward, they count an attempt so they reach max_attempts
+        for job in jobs:
+            job.last_error = str(error)
+        failed = jobs
+    else:
+        try:
+            for number, job in enumerate(jobs):
+                message = EmailMessage(job.subject, job.body, settings.DEFAULT_FROM_EMAIL, [job.to_email],
+                                       connection=connection)
+                try:
+                    connection.send_messages([message])
+                except Exception as error:
+                    job.last_error = str(error)
+                    failed.append(job)
+                    # the rest of the batch was never tried, it is released for the next batch
+                    if connection_lost(error):
+                        unattempted = jobs[number + 1:]
+                        break
+                else:
+                    sent.append(job)
+
+                if rate_limit:
+                    delay = (number + 1) / rate_limit - (time.monotonic() - started_at)
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            connection.close()
+
+    now = timezone.now()
+    EmailJob.objects.filter(pk__in=[job.pk for job in sent]).update(
+        status=EmailJob.EMAIL_STATUS_SENT, datetime_sent=now, attempts=F('attempts') + 1,
+    )
+    for job in failed:
+        job.attempts += 1
+        job.status = EmailJob.EMAIL_STATUS_FAILED if job.attempts >= max_attempts else EmailJob.EMAIL_STATUS_PENDING
+        # exponential backoff: 1, 2, 4, ... minutes
+        job.next_attempt_at = now + timedelta(minutes=2 ** (job.attempts - 1))
+    EmailJob.objects.bulk_update(failed, ['attempts', 'status', 'next_attempt_at', 'last_error'])
+    EmailJob.objects.filter(pk__in=[job.pk for job in unattempted]).update(next_attempt_at=now)
+
+    return {'sent': len(sent), 'failed': len(failed), 'unattempted': len(unattempted)}
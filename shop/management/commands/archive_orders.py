@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Moves old orders and their items into the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help='archive orders created more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        self.stdout.write(f"Archiving orders created before {cutoff:%Y-%m-%d}...")
+        archived = archive_orders(cutoff, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{archived} orders archived."))
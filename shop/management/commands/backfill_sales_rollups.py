@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from shop.analytics import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily sales rollups from hot and archived order items"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='first day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='last day to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        rows = rebuild_daily_sales(options['start'], options['end'])
+        self.stdout.write(self.style.SUCCESS(f"{rows} daily sales rows rebuilt."))
@@ -0,0 +1,113 @@
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from shop.benchmarks import git_revision, run_benchmark
+from shop.fake_data import FAKE_USERNAME_PREFIX, add_popularity_arguments, popularity_samplers, request_mix
+from shop.models import Category, Product
+from shop.cache import object_cache
+from shop.pool import pool_stats
+
+
+class Command(BaseCommand):
+    help = "Replays a request mix against the API in-process or against --base-url and reports throughput and latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=100, help='leading requests left out of the results')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the fake data and the request mix')
+        parser.add_argument('--mix-file', help='NDJSON written by generate_request_mix, generated from --seed otherwise')
+        parser.add_argument('--base-url', help='e.g. http://127.0.0.1:8000, runs in-process when omitted')
+        parser.add_argument('--users', type=int, default=None, help='customers to spread the clients over')
+        parser.add_argument('--setup-fake-data', action='store_true', help='regenerate the fake data with --seed first')
+        parser.add_argument('--output', help='json file to save the results to')
+        parser.add_argument('--compare', help='json results of an earlier run to compare with')
+        add_popularity_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options['setup_fake_data']:
+            call_command('setup_fake_data', seed=options['seed'], stdout=self.stdout)
+
+        requests = self.load_requests(options)
+        users = list(get_user_model().objects.filter(username__startswith=FAKE_USERNAME_PREFIX, customer__isnull=False)
+                     .order_by('id')[:options['users'] or options['concurrency']])
+        if not users:
+            raise CommandError("No fake customers, run setup_fake_data first.")
+
+        self.stdout.write(f"Replaying {len(requests)} requests with {options['concurrency']} clients "
+                          f"{'against ' + options['base_url'] if options['base_url'] else 'in-process'}...")
+        results = run_benchmark(requests, users, options['concurrency'], options['base_url'], options['warmup'])
+        results['meta'] = {
+            'revision': git_revision(),
+            'datetime': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'base_url': options['base_url'],
+            'requests': len(requests),
+            'concurrency': options['concurrency'],
+            'warmup': options['warmup'],
+            'seed': options['seed'],
+            'mix_file': options['mix_file'],
+        }
+        if not options['base_url']:
+            results['pool'] = pool_stats()['pools']
+            results['cache'] = object_cache.stats()['namespaces']
+
+        self.report(results)
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.compare(json.load(file), results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}."))
+
+        throttled = results['total']['statuses'].get('429')
+        if throttled:
+            raise CommandError(f"{throttled} requests were throttled, the results measure the throttle instead of the "
+                               f"endpoints. Disable TOKEN_BUCKET_RATES on the server under test.")
+
+    def load_requests(self, options):
+        if options['mix_file']:
+            with open(options['mix_file']) as file:
+                return [json.loads(line) for line in islice(file, options['requests']) if line.strip()]
+
+        products = Product.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        categories = Category.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        if not products or not categories:
+            raise CommandError("No products or categories, run setup_fake_data first.")
+        samplers = popularity_samplers(options['seed'], options, products, categories)
+        return list(request_mix(options['seed'], samplers['products'], samplers['categories'], options['requests']))
+
+    def report(self, results):
+        row = "{:<20} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8}"
+        self.stdout.write(row.format('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for name, summary in [*results['endpoints'].items(), ('TOTAL', results['total'])]:
+            self.stdout.write(row.format(name, *[
+                '-' if summary[key] is None else summary[key]
+                for key in ['requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+            ]))
+        self.stdout.write(f"Statuses: {results['total']['statuses']}")
+        for alias, stats in results.get('pool', {}).items():
+            self.stdout.write(f"Connection pool {alias}: {stats}")
+        for namespace, stats in results.get('cache', {}).items():
+            self.stdout.write(f"Object cache {namespace}: {stats}")
+
+    def compare(self, previous, results):
+        self.stdout.write(f"Compared with {previous.get('meta', {}).get('revision') or 'the previous run'}:")
+        pairs = [('TOTAL', previous['total'], results['total'])] + [
+            (name, previous['endpoints'][name], summary)
+            for name, summary in results['endpoints'].items() if name in previous['endpoints']
+        ]
+        for name, before, after in pairs:
+            changes = list()
+            for key in ['throughput', 'p95_ms', 'queries_per_request']:
+                if before.get(key) and after.get(key) is not None:
+                    changes.append(f"{key} {before[key]} -> {after[key]} ({(after[key] - before[key]) / before[key]:+.1%})")
+            self.stdout.write(f"  {name}: {', '.join(changes) or 'nothing to compare'}")
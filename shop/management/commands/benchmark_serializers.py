@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.benchmarks import SERIALIZER_BENCHMARKS, git_revision, run_serializer_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Measures serializer throughput and memory on unsaved instances, without touching the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--serializers', nargs='+', choices=list(SERIALIZER_BENCHMARKS), default=list(SERIALIZER_BENCHMARKS))
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000], help='objects per serializer call')
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs per size, the best one is reported')
+        parser.add_argument('--fields', action='store_true', help='also time every field on its own')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='json file to save the results to')
+        parser.add_argument('--compare', help='json results of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        results = run_serializer_benchmarks(options['serializers'], options['sizes'], options['repeat'],
+                                            options['fields'], options['seed'])
+
+        previous = dict()
+        if options['compare']:
+            with open(options['compare']) as file:
+                previous = json.load(file)['serializers']
+
+        row = "{:<24} {:>6} {:>12} {:>10} {:>10} {:>10} {:>10}"
+        self.stdout.write(row.format('serializer', 'size', 'objects/s', 'best ms', 'peak kb', 'kept kb', 'change'))
+        for name, sizes in results.items():
+            for size, result in sizes.items():
+                before = previous.get(name, {}).get(size)
+                change = f"{result['objects_per_s'] / before['objects_per_s'] - 1:+.1%}" if before else '-'
+                self.stdout.write(row.format(name, size, result['objects_per_s'], result['best_ms'], result['peak_kb'],
+                                             result['retained_kb'], change))
+                if 'field_us' in result:
+                    for field, micro_seconds in sorted(result['field_us'].items(), key=lambda item: -item[1]):
+                        self.stdout.write(f"    {field:<20} {micro_seconds} us/object")
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'meta': {'revision': git_revision(), 'datetime': timezone.now().isoformat(), 'repeat': options['repeat']},
+                    'serializers': results,
+                }, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}."))
@@ -0,0 +1,31 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from shop.exports import order_export_rows, EXPORT_RENDERERS
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = "Streams order lines as CSV or NDJSON for accounting"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='first day of orders (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='last day of orders (YYYY-MM-DD)')
+        parser.add_argument('--status', choices=[status for status, _ in Order.ORDER_STATUS])
+        parser.add_argument('--format', choices=list(EXPORT_RENDERERS), default='csv')
+        parser.add_argument('--include-archived', action='store_true')
+        parser.add_argument('--output', help='file to write to, defaults to stdout')
+
+    def handle(self, *args, **options):
+        render, _ = EXPORT_RENDERERS[options['format']]
+        rows = order_export_rows(options['start'], options['end'], options['status'], options['include_archived'])
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in render(rows):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,39 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from shop.fake_data import DEFAULT_REQUEST_MIX, add_popularity_arguments, popularity_samplers, request_mix
+from shop.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = "Writes a request mix (NDJSON) following the fake data popularity, use the seed and skew options of setup_fake_data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000)
+        parser.add_argument('--seed', type=int, required=True)
+        parser.add_argument('--output', help='file to write, defaults to stdout')
+        parser.add_argument('--mix', type=json.loads, default=DEFAULT_REQUEST_MIX,
+                            help=f'request weights as json, defaults to {json.dumps(DEFAULT_REQUEST_MIX)}')
+        add_popularity_arguments(parser)
+
+    def handle(self, *args, **options):
+        # setup_fake_data numbers the rows from 1, so the largest id is the row count
+        products = Product.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        categories = Category.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        if not products or not categories:
+            self.stderr.write(self.style.ERROR("No products or categories, run setup_fake_data first."))
+            return
+
+        samplers = popularity_samplers(options['seed'], options, products, categories)
+        output = open(options['output'], 'w') if options['output'] else sys.stdout
+        try:
+            for request in request_mix(options['seed'], samplers['products'], samplers['categories'], options['count'],
+                                       options['mix']):
+                output.write(json.dumps(request) + '\n')
+        finally:
+            if options['output']:
+                output.close()
+                self.stderr.write(self.style.SUCCESS(f"{options['count']} requests written to {options['output']}."))
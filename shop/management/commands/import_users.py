@@ -0,0 +1,38 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.onboarding import import_users
+
+
+class Command(BaseCommand):
+    help = "Imports users with their customers and addresses from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.csv file with a header row or .jsonl file')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='password hashing processes')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        with open(path, newline='') as file:
+            if path.endswith('.csv'):
+                rows = list(csv.DictReader(file))
+            elif path.endswith('.jsonl'):
+                rows = [json.loads(line) for line in file if line.strip()]
+            else:
+                raise CommandError('Only .csv and .jsonl files are supported.')
+
+        if any(not row.get('username') for row in rows):
+            raise CommandError('Every row needs a username.')
+
+        started_at = time.perf_counter()
+        result = import_users(rows, options['batch_size'], options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['created']} users created, {result['skipped']} skipped "
+            f"({len(result['existing'])} existing usernames left as they are) "
+            f"in {time.perf_counter() - started_at:.1f}s."
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from shop.models import Customer
+from shop.search import index_customers
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the customer search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Customer.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        for start in range(0, last_id, batch_size):
+            index_customers(list(
+                Customer.objects.filter(id__gt=start, id__lte=start + batch_size).values_list('id', flat=True)
+            ))
+
+        self.stdout.write(self.style.SUCCESS("Customer search index rebuilt."))
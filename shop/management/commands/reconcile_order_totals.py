@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from shop.models import Order, OrderStatusCount, Customer, Cart
+
+
+class Command(BaseCommand):
+    help = "Recalculates the stored order totals, the order status counters, the customer order stats and the cart item counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        updated = 0
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                updated += Order.objects.refresh_totals(
+                    Order.objects.filter(id__gt=start, id__lte=start + batch_size)
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"{updated} orders reconciled."))
+
+        counts = OrderStatusCount.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Order status counters rebuilt: {counts}"))
+
+        last_customer_id = Customer.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        customers = 0
+        for start in range(0, last_customer_id, batch_size):
+            customers += Customer.objects.refresh_order_stats(
+                Customer.objects.filter(id__gt=start, id__lte=start + batch_size)
+            )
+        self.stdout.write(self.style.SUCCESS(f"{customers} customers order stats reconciled."))
+
+        carts = Cart.objects.refresh_items_count()
+        self.stdout.write(self.style.SUCCESS(f"{carts} carts item counts reconciled."))
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop.bulk_jobs import claim_next_job, run_job, CHUNK_SIZE, STALE_AFTER
+from shop.models import AdminBulkJob
+
+
+class Command(BaseCommand):
+    help = "Runs queued admin bulk actions chunk by chunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='width of the primary key range of a chunk')
+        parser.add_argument('--forever', action='store_true', help='keep polling for new jobs')
+        parser.add_argument('--poll-interval', type=float, default=2)
+        parser.add_argument('--stale-after', type=float, default=STALE_AFTER.total_seconds(),
+                            help='seconds without a heartbeat before a running job is claimed again')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job(timedelta(seconds=options['stale_after']))
+            if job is None:
+                if not options['forever']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            if job.status == AdminBulkJob.JOB_STATUS_CANCELED:
+                continue
+
+            self.stdout.write(f"Running {job}...")
+            run_job(job, options['chunk_size'])
+            job.refresh_from_db()
+            self.stdout.write(f"{job} finished as {job.get_status_display()}, {job.rows_affected} rows affected.")
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.mailing import deliver_batch
+
+
+class Command(BaseCommand):
+    help = "Delivers queued customer emails in batches over one connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_QUEUE_BATCH_SIZE)
+        parser.add_argument('--rate', type=float, default=settings.EMAIL_QUEUE_RATE_LIMIT,
+                            help='maximum emails per second')
+        parser.add_argument('--max-attempts', type=int, default=settings.EMAIL_QUEUE_MAX_ATTEMPTS)
+        parser.add_argument('--forever', action='store_true', help='keep polling for new jobs')
+        parser.add_argument('--poll-interval', type=float, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            result = deliver_batch(options['batch_size'], options['rate'], options['max_attempts'])
+            if result['sent'] or result['failed']:
+                self.stdout.write(f"{result['sent']} emails sent, {result['failed']} failed, "
+                                  f"{result['unattempted']} left for the next batch.")
+            elif not options['forever']:
+                break
+            else:
+                time.sleep(options['poll_interval'])
@@ -1,136 +1,157 @@
 import random
-from faker import Faker
-from datetime import datetime, timedelta
-import factory
-from factory.fuzzy import FuzzyDateTime
-
-from django.db import transaction
+import time
+from io import StringIO
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
 from django.utils import timezone
-from django.core.management.base import BaseCommand
-from django.utils.timezone import make_aware
-from django.utils.timezone import get_current_timezone
-from config import settings
-
-from shop.models import Address, Cart, CartItem, Category, Comment, Order, OrderItem, Product, Discount, Customer
-from shop.factories import (
-    CartFactory,
-    CategoryFactory,
-    CommentFactory,
-    OrderItemFactory,
-    ProductFactory,
-    DiscountFactory,
-    CustomerFactory,
-    AddressFactory,
-    OrderFactory,
-    CartItemFactory,
-)
 
-faker = Faker()
+from shop.analytics import rebuild_daily_sales
+from shop.cache import object_cache
+from shop.fake_data import (
+    FAKE_USERNAME_PREFIX,
+    add_popularity_arguments,
+    popularity_samplers,
+    generate_in_chunks,
+    generate_categories,
+    generate_discounts,
+    generate_products,
+    generate_customers,
+    generate_orders,
+    generate_comments,
+    generate_carts,
+)
+from shop.models import Address, Cart, CartItem, Category, Comment, Order, OrderItem, Product, Discount, Customer, \
+    ArchivedOrder, ArchivedOrderItem, DailyProductSales, CustomerSearchTerm, EmailJob, OrderStatusCount
 
-list_of_models = [CartItem, Cart, OrderItem, Order, Product, Category, Comment, Discount, Address, Customer]
 
-NUM_CATEGORIES = 100
-NUM_DISCOUNTS = 10
-NUM_PRODUCTS = 1000
-NUM_CUSTOMERS = 100
-NUM_ORDERS = 30
-NUM_CARTS = 100
+# children before parents, sqlite deletes the tables in this order
+list_of_models = [CartItem, Cart, OrderItem, Order, ArchivedOrderItem, ArchivedOrder, DailyProductSales, Comment,
+                  Product.discount.through, Product, Category, Discount, Address, CustomerSearchTerm, EmailJob, Customer]
 
 
 class Command(BaseCommand):
-    help = "Generates fake data"
-
-    @transaction.atomic
-    def handle(self, *args, **kwargs):
-        self.stdout.write("Deleting old data...")
-        models = list_of_models
-        for m in models:
-            m.objects.all().delete()
-
-        self.stdout.write("Creating new data...\n")
-
-        tz = timezone.get_current_timezone()
-
-        # Categories data
-        print(f"Adding {NUM_CATEGORIES} categories...", end='')
-        all_categories = [CategoryFactory(top_product=None) for _ in range(NUM_CATEGORIES)]
-        print('DONE')
-
-        # Discounts data
-        print(f"Adding {NUM_DISCOUNTS} discounts...", end='')
-        all_discounts = [DiscountFactory() for _ in range(NUM_DISCOUNTS)]
-        print('DONE')
-
-        # Products data
-        print(f"Adding {NUM_PRODUCTS} product...", end='')
-        all_products = list()
-        for _ in range(NUM_PRODUCTS):
-            new_product = ProductFactory(category_id=random.choice(all_categories).id)
-            new_product.datetime_created = datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12), tzinfo=timezone.utc)
-            new_product.datetime_modified = new_product.datetime_created + timedelta(hours=random.randint(1, 500))
-            new_product.save()
-            all_products.append(new_product)
-        print('DONE')
-
-        # Customers data
-        print(f"Adding {NUM_CUSTOMERS} customers...", end='')
-        all_customers = [(CustomerFactory() if (random.random() > 0.3) else CustomerFactory(birth_date=None)) for _ in range(NUM_CUSTOMERS) ]
-        print('DONE')
-
-        # Addresses data
-        print(f"Adding customers addresses...", end='')
-        all_addresses = [
-            AddressFactory(customer_id=customer.id) for customer in all_customers
-        ]
-        print('DONE')
-
-        # Orders data
-        print(f"Adding {NUM_ORDERS} orders...", end='')
-        all_orders = [OrderFactory(
-            customer_id=random.choice(all_customers).id
-        ) for _ in range(NUM_ORDERS)]
-        for order in all_orders:
-            order.datetime_created = datetime(random.randrange(2019, 2023),random.randint(1,12),random.randint(1,12))
-            order.save()
-        print('DONE')
-
-        # OrderItems data
-        print(f"Adding order items...", end='')
-        all_order_items = list()
-        for order in all_orders:
-            products = random.sample(all_products, random.randint(1, 10))
-            for product in products:
-                order_item = OrderItemFactory(
-                    order_id=order.id,
-                    product_id=product.id,
-                    unit_price=product.unit_price,
-                )
-                all_order_items.append(order_item)
-        print('DONE')
-
-        # Comments data
-        print(f"Adding product comments...", end='')
-        for product in all_products:
-            for _ in range(random.randint(1, 5)):
-                comment = CommentFactory(product_id=product.id)
-                comment.datetime_created = datetime(random.randrange(2019, 2023), random.randint(1,12),random.randint(1, 12))
-                comment.save()
-        print('DONE')
-
-        # Carts data
-        print(f"Adding {NUM_CARTS} carts...", end='')
-        all_carts = [CartFactory() for _ in range(NUM_CARTS)]
-        print('DONE')
-
-        # CartItems data
-        print(f"Adding cart items...", end='')
-        all_cart_items = list()
-        for cart in all_carts:
-            products = random.sample(all_products, random.randint(1, 10))
-            for product in products:
-                cart_item = CartItemFactory(
-                    cart_id=cart.id,
-                    product_id=product.id,
+    help = "Generates fake data with skewed popularity, --seed makes it reproducible for the same seed and batch size"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=100)
+        parser.add_argument('--discounts', type=int, default=10)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=30)
+        parser.add_argument('--carts', type=int, default=100)
+        parser.add_argument('--comments-per-product', type=int, default=50, help='maximum comments of a product')
+        parser.add_argument('--comment-tail', type=float, default=1.2, help='pareto shape of comments per product, lower is a longer tail')
+        parser.add_argument('--items-per-order', type=int, default=10, help='maximum items of an order')
+        parser.add_argument('--items-per-cart', type=int, default=10, help='maximum items of a cart')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--workers', type=int, default=None, help='generator processes, defaults to the cpu count')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        add_popularity_arguments(parser)
+
+    @contextmanager
+    def phase(self, title):
+        self.stdout.write(f"{title}...", ending='')
+        self.stdout.flush()
+        started = time.perf_counter()
+        yield
+        self.stdout.write(self.style.SUCCESS(f" DONE ({time.perf_counter() - started:.2f}s)"))
+
+    def insert(self, model, rows):
+        model.objects.bulk_create([model(**row) for row in rows], batch_size=self.batch_size)
+
+    def generate(self, generator, total, **context):
+        return generate_in_chunks(generator, total, self.seed, context, self.batch_size, self.workers)
+
+    def handle(self, *args, **options):
+        # checked before the old data is deleted, the samplers cannot pick from nothing
+        if options['products'] > 0 and options['categories'] < 1:
+            raise CommandError("Products need at least one category.")
+        if options['orders'] > 0 and options['customers'] < 1:
+            raise CommandError("Orders need at least one customer.")
+
+        User = get_user_model()
+        self.seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        started = time.perf_counter()
+        self.stdout.write(f"Seed: {self.seed}")
+        samplers = popularity_samplers(self.seed, options, options['products'], options['categories'], options['customers'])
+
+        with self.phase("Deleting old data"):
+            tables = [model._meta.db_table for model in list_of_models]
+            connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, reset_sequences=True))
+            User.objects.filter(username__startswith=FAKE_USERNAME_PREFIX).delete()
+
+        # the generator processes do not use the database, do not hand them open connections
+        connection.close()
+
+        with self.phase(f"Adding {options['categories']} categories"):
+            for categories in self.generate(generate_categories, options['categories']):
+                self.insert(Category, categories)
+
+        with self.phase(f"Adding {options['discounts']} discounts"):
+            for discounts in self.generate(generate_discounts, options['discounts']):
+                self.insert(Discount, discounts)
+
+        with self.phase(f"Adding {options['products']} products"):
+            for products in self.generate(generate_products, options['products'], categories=samplers['categories']):
+                self.insert(Product, products)
+
+        with self.phase(f"Adding {options['customers']} customers with users and addresses"):
+            first_user_id = (User.objects.aggregate(last_id=Max('id'))['last_id'] or 0) + 1
+            # one shared hash, hashing a password per fake user would dominate the run
+            password = make_password('password')
+            for users, customers, addresses in self.generate(generate_customers, options['customers'],
+                                                             first_user_id=first_user_id, password=password):
+                with transaction.atomic():
+                    self.insert(User, users)
+                    self.insert(Customer, customers)
+                    self.insert(Address, addresses)
+
+        with self.phase(f"Adding {options['orders']} orders with items"):
+            statuses = [Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED]
+            for orders, items in self.generate(generate_orders, options['orders'], products=samplers['products'],
+                                               customers=samplers['customers'], statuses=statuses,
+                                               items_per_order=options['items_per_order']):
+                with transaction.atomic():
+                    self.insert(Order, orders)
+                    self.insert(OrderItem, items)
+
+        with self.phase("Adding product comments"):
+            statuses = [status for status, _ in Comment.COMMENT_STATUS]
+            for comments in self.generate(generate_comments, options['products'], products=samplers['products'],
+                                          statuses=statuses, comments_per_product=options['comments_per_product'],
+                                          comment_tail=options['comment_tail']):
+                self.insert(Comment, comments)
+
+        with self.phase(f"Adding {options['carts']} carts with items"):
+            for carts, items in self.generate(generate_carts, options['carts'], products=samplers['products'],
+                                              items_per_cart=options['items_per_cart'], now=timezone.now()):
+                with transaction.atomic():
+                    self.insert(Cart, carts)
+                    self.insert(CartItem, items)
+
+        with self.phase("Rebuilding order status counters and customer order stats"):
+            OrderStatusCount.objects.rebuild()
+            for start in range(0, options['customers'], self.batch_size):
+                Customer.objects.refresh_order_stats(
+                    Customer.objects.filter(id__gt=start, id__lte=start + self.batch_size)
                 )
-                all_cart_items.append(cart_item)
-        print('DONE')
+
+        with self.phase("Rebuilding daily sales rollups"):
+            rebuild_daily_sales()
+
+        with self.phase("Rebuilding customer search index"):
+            call_command('rebuild_customer_search', batch_size=self.batch_size, stdout=StringIO())
+
+        # the ids were reused, nothing cached before is valid anymore
+        object_cache.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS(f"Fake data generated in {time.perf_counter() - started:.2f}s."))
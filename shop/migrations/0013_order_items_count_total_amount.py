@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:13
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_order_totals(apps, schema_editor):
+    # the same update as Order.objects.refresh_totals, which is not available on historical models
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    amount_field = DecimalField(max_digits=12, decimal_places=2)
+
+    items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    items_count = items.annotate(c=Count('id')).values('c')
+    total_amount = items.annotate(t=Sum(F('quantity') * F('unit_price'), output_field=amount_field)).values('t')
+    Order.objects.update(
+        items_count=Coalesce(Subquery(items_count), Value(0)),
+        total_amount=Coalesce(Subquery(total_amount), Value(0), output_field=amount_field),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_alter_cartitem_cart_alter_cartitem_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='items count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='total amount'),
+        ),
+        migrations.RunPython(populate_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_sales(apps, schema_editor):
+    # the same rollups as analytics.rebuild_daily_sales, which is not available on historical models
+    DailyProductSales = apps.get_model('shop', 'DailyProductSales')
+
+    rows = dict()
+    for model_name in ['OrderItem', 'ArchivedOrderItem']:
+        grouped = apps.get_model('shop', model_name).objects \
+            .annotate(date=TruncDate('order__datetime_created')) \
+            .values('date', 'product_id', 'order__status') \
+            .annotate(
+                category_id=F('product__category_id'),
+                total_quantity=Sum('quantity'),
+                total_revenue=Sum(F('quantity') * F('unit_price'),
+                                  output_field=DecimalField(max_digits=14, decimal_places=2)),
+                total_lines=Count('id'),
+            ).order_by()
+
+        for row in grouped:
+            key = (row['date'], row['product_id'], row['order__status'])
+            if key not in rows:
+                rows[key] = DailyProductSales(date=key[0], product_id=key[1], status=key[2],
+                                              category_id=row['category_id'])
+            rows[key].quantity += row['total_quantity']
+            rows[key].revenue += row['total_revenue']
+            rows[key].order_lines += row['total_lines']
+
+    DailyProductSales.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('status', models.CharField(choices=[('UN', 'Unpaid'), ('P', 'Paid'), ('C', 'Canceled')], max_length=10)),
+                ('quantity', models.IntegerField(default=0, verbose_name='quantity')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='revenue')),
+                ('order_lines', models.IntegerField(default=0, verbose_name='order lines')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'category'], name='shop_dailyp_date_2da432_idx')],
+                'unique_together': {('date', 'product', 'status')},
+            },
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
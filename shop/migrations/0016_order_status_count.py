@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_order_status_counts(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    OrderStatusCount = apps.get_model('shop', 'OrderStatusCount')
+
+    counts = dict(Order.objects.order_by().values_list('status').annotate(c=Count('id')))
+    OrderStatusCount.objects.bulk_create([
+        OrderStatusCount(status=status, count=counts.get(status, 0)) for status in ['UN', 'P', 'C']
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_daily_product_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('UN', 'Unpaid'), ('P', 'Paid'), ('C', 'Canceled')], max_length=10, unique=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'datetime_created'], name='shop_order_status_f0f709_idx'),
+        ),
+        migrations.RunPython(populate_order_status_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:19
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def populate_customer_order_stats(apps, schema_editor):
+    # the same update as Customer.objects.refresh_order_stats, which is not available on historical models
+    Customer = apps.get_model('shop', 'Customer')
+    amount_field = DecimalField(max_digits=14, decimal_places=2)
+
+    stats = dict()
+    for model_name in ['Order', 'ArchivedOrder']:
+        orders = apps.get_model('shop', model_name).objects.filter(customer_id=OuterRef('pk')).order_by() \
+            .values('customer_id')
+        stats[model_name] = {
+            'count': Coalesce(Subquery(orders.annotate(c=Count('id')).values('c')), Value(0)),
+            'spent': Coalesce(Subquery(orders.exclude(status='C').annotate(s=Sum('total_amount')).values('s')),
+                              Value(0), output_field=amount_field),
+            'last': Subquery(orders.annotate(m=Max('datetime_created')).values('m')),
+        }
+
+    last_hot, last_archived = stats['Order']['last'], stats['ArchivedOrder']['last']
+    Customer.objects.update(
+        orders_count=stats['Order']['count'] + stats['ArchivedOrder']['count'],
+        total_spent=stats['Order']['spent'] + stats['ArchivedOrder']['spent'],
+        last_order_at=Greatest(Coalesce(last_hot, last_archived), Coalesce(last_archived, last_hot)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_order_status_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='date of last order'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='orders_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='orders count'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='total_spent',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='total spent'),
+        ),
+        migrations.RunPython(populate_customer_order_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from shop.search import customer_terms
+
+
+def populate_customer_search_terms(apps, schema_editor):
+    # the terms index_customers writes, the admin search reads nothing but this table
+    Customer = apps.get_model('shop', 'Customer')
+    CustomerSearchTerm = apps.get_model('shop', 'CustomerSearchTerm')
+
+    terms = list()
+    for customer in Customer.objects.select_related('user').order_by('id').iterator(chunk_size=2000):
+        terms.extend(CustomerSearchTerm(customer_id=customer.id, kind=kind, term=term)
+                     for kind, term in customer_terms(customer))
+        if len(terms) >= 10000:
+            CustomerSearchTerm.objects.bulk_create(terms, batch_size=2000)
+            terms = list()
+    CustomerSearchTerm.objects.bulk_create(terms, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_customer_order_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('P', 'Prefix'), ('T', 'Trigram')], max_length=1)),
+                ('term', models.CharField(max_length=20)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='shop.customer')),
+            ],
+            options={
+                'unique_together': {('kind', 'term', 'customer')},
+            },
+        ),
+        migrations.RunPython(populate_customer_search_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_customer_search_term'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_email', models.EmailField(max_length=254, verbose_name='email')),
+                ('subject', models.CharField(max_length=255, verbose_name='subject')),
+                ('body', models.TextField(verbose_name='body')),
+                ('status', models.CharField(choices=[('W', 'Pending'), ('S', 'Sent'), ('F', 'Failed')], default='W', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date of created')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_sent', models.DateTimeField(blank=True, null=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_jobs', to='shop.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='shop_emailj_status_111d8e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_email_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdminBulkJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=100)),
+                ('model_label', models.CharField(max_length=100)),
+                ('object_ids', models.JSONField(blank=True, null=True)),
+                ('changelist_query', models.TextField(blank=True)),
+                ('first_pk', models.BigIntegerField(blank=True, null=True)),
+                ('last_pk', models.BigIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('Q', 'Queued'), ('R', 'Running'), ('D', 'Done'), ('C', 'Canceled'), ('F', 'Failed')], default='Q', max_length=1)),
+                ('total_chunks', models.PositiveIntegerField(default=0)),
+                ('done_chunks', models.PositiveIntegerField(default=0)),
+                ('rows_affected', models.PositiveIntegerField(default=0)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date of created')),
+                ('datetime_started', models.DateTimeField(blank=True, null=True)),
+                ('datetime_finished', models.DateTimeField(blank=True, null=True)),
+                ('datetime_heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:27
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_cart_items_count(apps, schema_editor):
+    Cart = apps.get_model('shop', 'Cart')
+    CartItem = apps.get_model('shop', 'CartItem')
+
+    items_count = CartItem.objects.filter(cart_id=OuterRef('pk')).order_by().values('cart_id') \
+        .annotate(c=Count('id')).values('c')
+    Cart.objects.update(items_count=Coalesce(Subquery(items_count), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_admin_bulk_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='items count'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='items count'),
+        ),
+        migrations.RunPython(populate_cart_items_count, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.models import Count, DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.utils.translation import gettext_lazy as _ 
 from django.utils import timezone
 from django.contrib.auth import get_user_model
@@ -6,11 +8,22 @@ from django.core.validators import MinValueValidator
 from django.conf import settings
 from uuid import uuid4
 
+from .cache import object_cache
+
+
+class CategoryMethod(models.Manager):
+    def cached(self, category_id):
+        # misses read the primary, a lagging replica would cache what was just invalidated
+        return object_cache.get_or_load('category', category_id, lambda: self.db_manager(DEFAULT_DB_ALIAS).annotate(
+            number_of_products=Count('products')).filter(pk=category_id).first())
+
 
 class Category(models.Model):
     title = models.CharField(max_length=200, verbose_name=_('name'))
     description = models.TextField(verbose_name=_('body'), blank=True)
     top_product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True, related_name='+')
+
+    objects = CategoryMethod()
     
     def __str__(self):
         return self.title
@@ -21,6 +34,12 @@ class Discount(models.Model):
     description = models.TextField(verbose_name=_('description'))
     
 
+class ProductMethod(models.Manager):
+    def cached(self, product_id):
+        return object_cache.get_or_load('product', product_id, lambda: self.db_manager(DEFAULT_DB_ALIAS).select_related(
+            'category').filter(pk=product_id).first())
+
+
 class Product(models.Model):
     name = models.CharField(max_length=150, verbose_name=_('title'))
     description = models.TextField(verbose_name=_('description'))
@@ -32,16 +51,63 @@ class Product(models.Model):
     discount = models.ManyToManyField('Discount', blank=True, related_name='products')
     datetime_created = models.DateTimeField(default=timezone.now , verbose_name=_('date of created'))
     datetime_modified = models.DateTimeField(auto_now=True, verbose_name=_('date of modified'))
+
+    objects = ProductMethod()
     
     def __str__(self):
         return self.name
     
 
+class CustomerOrderStatsMethod(models.Manager):
+    def cached_by_user(self, user_id):
+        return object_cache.get_or_load('customer', user_id, lambda: self.db_manager(DEFAULT_DB_ALIAS).select_related(
+            'user').filter(user_id=user_id).first())
+
+    def invalidate_cached(self, queryset=None):
+        if queryset is None:
+            transaction.on_commit(lambda: object_cache.invalidate_namespace('customer'))
+            return
+        user_ids = [user_id for user_id in queryset.values_list('user_id', flat=True) if user_id is not None]
+        transaction.on_commit(lambda: object_cache.invalidate('customer', *user_ids))
+
+    def refresh_order_stats(self, queryset=None):
+        self.invalidate_cached(queryset)
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        amount_field = DecimalField(max_digits=14, decimal_places=2)
+        stats = dict()
+        for model in [Order, ArchivedOrder]:
+            orders = model.objects.filter(customer_id=OuterRef('pk')).order_by().values('customer_id')
+            spent_orders = orders.exclude(status=Order.ORDER_STATUS_CANCELED)
+            stats[model] = {
+                'count': Coalesce(Subquery(orders.annotate(c=Count('id')).values('c')), Value(0)),
+                'spent': Coalesce(Subquery(spent_orders.annotate(s=Sum('total_amount')).values('s')),
+                                  Value(0), output_field=amount_field),
+                'last': Subquery(orders.annotate(m=Max('datetime_created')).values('m')),
+            }
+
+        # either side may be empty, and a backdated order can make the hot one the older
+        last_hot, last_archived = stats[Order]['last'], stats[ArchivedOrder]['last']
+        return queryset.update(
+            orders_count=stats[Order]['count'] + stats[ArchivedOrder]['count'],
+            total_spent=stats[Order]['spent'] + stats[ArchivedOrder]['spent'],
+            last_order_at=Greatest(Coalesce(last_hot, last_archived), Coalesce(last_archived, last_hot)),
+        )
+
+
 class Customer(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True)
     phone_number = models.CharField(max_length=250, verbose_name=_('phone_number'))
     birth_date = models.DateField(verbose_name=_('birthdate'), null=True, blank=True)
     email = models.EmailField(verbose_name=_('email'), blank=True, null=True)
+    orders_count = models.PositiveIntegerField(default=0, editable=False, db_index=True, verbose_name=_('orders count'))
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False, db_index=True,
+                                      verbose_name=_('total spent'))
+    last_order_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True,
+                                         verbose_name=_('date of last order'))
+    
+    objects = CustomerOrderStatsMethod()
     
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
@@ -63,6 +129,51 @@ class Customer(models.Model):
             ('send_private_email', 'can send private email to customers.')
         ]
     
+
+
+class CustomerSearchTerm(models.Model):
+    KIND_PREFIX = 'P'
+    KIND_TRIGRAM = 'T'
+    KINDS = (
+        (KIND_PREFIX, 'Prefix'),
+        (KIND_TRIGRAM, 'Trigram'),
+    )
+    
+    customer = models.ForeignKey('Customer', on_delete=models.CASCADE, related_name='search_terms')
+    kind = models.CharField(max_length=1, choices=KINDS)
+    term = models.CharField(max_length=20)
+    
+    class Meta:
+        unique_together = [['kind', 'term', 'customer']]
+    
+
+
+class EmailJob(models.Model):
+    EMAIL_STATUS_PENDING = 'W'
+    EMAIL_STATUS_SENT = 'S'
+    EMAIL_STATUS_FAILED = 'F'
+    EMAIL_STATUS = (
+        (EMAIL_STATUS_PENDING, 'Pending'),
+        (EMAIL_STATUS_SENT, 'Sent'),
+        (EMAIL_STATUS_FAILED, 'Failed'),
+    )
+    
+    customer = models.ForeignKey('Customer', on_delete=models.CASCADE, related_name='email_jobs')
+    to_email = models.EmailField(verbose_name=_('email'))
+    subject = models.CharField(max_length=255, verbose_name=_('subject'))
+    body = models.TextField(verbose_name=_('body'))
+    status = models.CharField(max_length=1, choices=EMAIL_STATUS, default=EMAIL_STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    datetime_created = models.DateTimeField(default=timezone.now, verbose_name=_('date of created'))
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    datetime_sent = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
     
 class Address(models.Model):
     customer = models.OneToOneField("Customer", on_delete=models.CASCADE, primary_key=True)
@@ -87,6 +198,24 @@ class StatusOrderMethod(models.Manager):
             return self.get_queryset().filter(status=status)
         return self.get_queryset()
 
+    def count_by_status(self, status):
+        return OrderStatusCount.objects.counts().get(status, 0)
+
+    def refresh_totals(self, queryset=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+        items_count = items.annotate(c=Count('id')).values('c')
+        total_amount = items.annotate(
+            t=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        ).values('t')
+
+        return queryset.update(
+            items_count=Coalesce(Subquery(items_count), Value(0)),
+            total_amount=Coalesce(Subquery(total_amount), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        )
+
 
 class Order(models.Model):
     ORDER_STATUS_PAID = 'P'
@@ -97,10 +226,17 @@ class Order(models.Model):
         (ORDER_STATUS_PAID, 'Paid'),
         (ORDER_STATUS_CANCELED, 'Canceled')
     )
+    ORDER_STATUS_TRANSITIONS = {
+        ORDER_STATUS_UNPAID: [ORDER_STATUS_PAID, ORDER_STATUS_CANCELED],
+        ORDER_STATUS_PAID: [ORDER_STATUS_CANCELED],
+        ORDER_STATUS_CANCELED: [],
+    }
     
     customer = models.ForeignKey('Customer', on_delete=models.PROTECT, related_name='orders')
     datetime_created = models.DateTimeField(default=timezone.now , verbose_name=_('date of created'))
     status = models.CharField(max_length=10, choices=ORDER_STATUS, default=ORDER_STATUS_UNPAID)
+    items_count = models.PositiveIntegerField(default=0, db_index=True, verbose_name=_('items count'))
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_('total amount'))
     
     # manager
     objects = StatusOrderMethod()
@@ -109,7 +245,52 @@ class Order(models.Model):
     def __str__(self):
         return f"{self.customer} --> order_id :{self.id}"
     
+    @classmethod
+    def can_transition(cls, from_status, to_status):
+        return to_status in cls.ORDER_STATUS_TRANSITIONS.get(from_status, [])
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['datetime_created']),
+            models.Index(fields=['status', 'datetime_created']),
+        ]
+    
     
+class OrderStatusCountMethod(models.Manager):
+    def counts(self):
+        return dict(self.get_queryset().values_list('status', 'count'))
+
+    def adjust(self, deltas):
+        # applied once the order changes commit, so concurrent checkouts do not queue on the lock
+        # of a counter row until their transaction ends. reconcile_order_totals rebuilds the counts
+        # if a process dies in between
+        deltas = {status: delta for status, delta in deltas.items() if delta}
+        if deltas:
+            transaction.on_commit(lambda: self.apply(deltas))
+
+    def apply(self, deltas):
+        for status, delta in deltas.items():
+            if not self.get_queryset().filter(status=status).update(count=F('count') + delta):
+                counter, _ = self.get_or_create(status=status)
+                self.get_queryset().filter(pk=counter.pk).update(count=F('count') + delta)
+
+    def rebuild(self):
+        counts = dict(Order.objects.order_by().values_list('status').annotate(c=Count('id')))
+        for status, _ in Order.ORDER_STATUS:
+            self.update_or_create(status=status, defaults={'count': counts.get(status, 0)})
+        return counts
+
+
+class OrderStatusCount(models.Model):
+    status = models.CharField(max_length=10, choices=Order.ORDER_STATUS, unique=True)
+    count = models.IntegerField(default=0)
+    
+    objects = OrderStatusCountMethod()
+    
+    def __str__(self):
+        return f"{self.get_status_display()} : {self.count}"
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey('Order', on_delete=models.PROTECT, related_name='items')
     product = models.ForeignKey('Product', on_delete=models.PROTECT, related_name='order_items')
@@ -119,10 +300,76 @@ class OrderItem(models.Model):
     class Meta:
         unique_together = [['order', 'product']]
         
+
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey('Customer', on_delete=models.PROTECT, related_name='archived_orders')
+    datetime_created = models.DateTimeField(verbose_name=_('date of created'))
+    status = models.CharField(max_length=10, choices=Order.ORDER_STATUS)
+    items_count = models.PositiveIntegerField(default=0, verbose_name=_('items count'))
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name=_('total amount'))
+    datetime_archived = models.DateTimeField(default=timezone.now, verbose_name=_('date of archived'))
+    
+    def __str__(self):
+        return f"{self.customer} --> archived order_id :{self.id}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'datetime_created']),
+        ]
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey('ArchivedOrder', on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey('Product', on_delete=models.PROTECT, related_name='archived_order_items')
+    quantity = models.PositiveSmallIntegerField(default=1, verbose_name=_('quantity'))
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    
+    class Meta:
+        unique_together = [['order', 'product']]
+        
+
+class DailyProductSales(models.Model):
+    date = models.DateField(verbose_name=_('date'))
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=10, choices=Order.ORDER_STATUS)
+    # signed, a drifted rollup shows up below zero instead of failing the write
+    quantity = models.IntegerField(default=0, verbose_name=_('quantity'))
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name=_('revenue'))
+    order_lines = models.IntegerField(default=0, verbose_name=_('order lines'))
+    
+    class Meta:
+        unique_together = [['date', 'product', 'status']]
+        indexes = [
+            models.Index(fields=['date', 'category']),
+        ]
+        
         
+class CartMethod(models.Manager):
+    def add_items(self, cart_id, count):
+        return self.get_queryset().filter(pk=cart_id).update(items_count=F('items_count') + count)
+
+    def remove_items(self, cart_id, count):
+        return self.get_queryset().filter(pk=cart_id, items_count__gte=count).update(items_count=F('items_count') - count)
+
+    def refresh_items_count(self, queryset=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        items_count = CartItem.objects.filter(cart_id=OuterRef('pk')).order_by().values('cart_id') \
+            .annotate(c=Count('id')).values('c')
+        return queryset.update(items_count=Coalesce(Subquery(items_count), Value(0)))
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(default=timezone.now, verbose_name=_('created_at'))
+    items_count = models.PositiveIntegerField(default=0, editable=False, db_index=True, verbose_name=_('items count'))
+
+    # manager
+    objects = CartMethod()
 
 
 class CartItem(models.Model):
@@ -134,6 +381,50 @@ class CartItem(models.Model):
         unique_together = [['cart', 'product']]
 
 
+class AdminBulkJob(models.Model):
+    JOB_STATUS_QUEUED = 'Q'
+    JOB_STATUS_RUNNING = 'R'
+    JOB_STATUS_DONE = 'D'
+    JOB_STATUS_CANCELED = 'C'
+    JOB_STATUS_FAILED = 'F'
+    JOB_STATUS = (
+        (JOB_STATUS_QUEUED, 'Queued'),
+        (JOB_STATUS_RUNNING, 'Running'),
+        (JOB_STATUS_DONE, 'Done'),
+        (JOB_STATUS_CANCELED, 'Canceled'),
+        (JOB_STATUS_FAILED, 'Failed'),
+    )
+    
+    action = models.CharField(max_length=100)
+    model_label = models.CharField(max_length=100)
+    # the selected rows, or None with the changelist filters of a select across
+    object_ids = models.JSONField(null=True, blank=True)
+    changelist_query = models.TextField(blank=True)
+    first_pk = models.BigIntegerField(null=True, blank=True)
+    last_pk = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=1, choices=JOB_STATUS, default=JOB_STATUS_QUEUED)
+    total_chunks = models.PositiveIntegerField(default=0)
+    done_chunks = models.PositiveIntegerField(default=0)
+    rows_affected = models.PositiveIntegerField(default=0)
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    datetime_created = models.DateTimeField(default=timezone.now, verbose_name=_('date of created'))
+    datetime_started = models.DateTimeField(null=True, blank=True)
+    datetime_finished = models.DateTimeField(null=True, blank=True)
+    # touched after every chunk, a running job that stops beating is claimed again
+    datetime_heartbeat = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.action} on {self.model_label} --> job_id :{self.id}"
+    
+    @property
+    def progress(self):
+        if not self.total_chunks:
+            return 100 if self.status == self.JOB_STATUS_DONE else 0
+        return round(self.done_chunks * 100 / self.total_chunks)
+
+
 class ApprovedCommentMethod(models.Manager):
     def get_approved(self):
         return self.get_queryset().filter(status=Comment.COMMENT_STATUS_APPROVED)
@@ -0,0 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .models import Customer, Address
+from .search import index_customers
+
+
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name']
+ADDRESS_FIELDS = ['province', 'city', 'address_detail']
+
+
+def hash_passwords(passwords, workers=1):
+    # a process pool only pays off for the import_users command, requests hash in-process
+    if workers == 1 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def import_users_batch(rows, workers=1):
+    User = get_user_model()
+
+    rows_by_username = {row['username']: row for row in rows}
+    usernames = list(rows_by_username)
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    new_rows = [row for username, row in rows_by_username.items() if username not in existing]
+    new_usernames = [row['username'] for row in new_rows]
+
+    # a blank password makes the user unusable, make_password('') would hash the empty string
+    hashed_passwords = hash_passwords([row.get('password') or None for row in new_rows], workers)
+
+    with transaction.atomic():
+        # bulk_create sends no post_save, so create_customer_for_new_user does not run
+        # and the customers are created here instead
+        User.objects.bulk_create([
+            User(password=password, **{field: row.get(field) or '' for field in USER_FIELDS})
+            for row, password in zip(new_rows, hashed_passwords)
+        ], ignore_conflicts=True)
+
+        # mysql does not return the primary keys of bulk inserted rows. only the new usernames,
+        # an existing user is left as it is even if it has no customer. rows dropped by
+        # ignore_conflicts, e.g. a username taken meanwhile, already have their customer
+        user_ids = dict(
+            User.objects.filter(username__in=new_usernames, customer__isnull=True).values_list('username', 'id')
+        )
+
+        Customer.objects.bulk_create([
+            Customer(
+                user_id=user_id,
+                email=rows_by_username[username].get('email') or None,
+                phone_number=rows_by_username[username].get('phone_number') or '',
+                birth_date=rows_by_username[username].get('birth_date') or None,
+            ) for username, user_id in user_ids.items()
+        ])
+
+        customer_ids = dict(
+            Customer.objects.filter(user_id__in=user_ids.values()).values_list('user__username', 'id')
+        )
+        Address.objects.bulk_create([
+            Address(customer_id=customer_id, **{field: rows_by_username[username][field] for field in ADDRESS_FIELDS})
+            for username, customer_id in customer_ids.items()
+            if all(rows_by_username[username].get(field) for field in ADDRESS_FIELDS)
+        ])
+        index_customers(list(customer_ids.values()))
+
+    created = len(user_ids)
+    return {'created': created, 'skipped': len(rows) - created, 'existing': sorted(existing)}
+
+
+def import_users(rows, batch_size=1000, workers=1):
+    result = {'created': 0, 'skipped': 0, 'existing': []}
+    for start in range(0, len(rows), batch_size):
+        batch_result = import_users_batch(rows[start:start + batch_size], workers)
+        result['created'] += batch_result['created']
+        result['skipped'] += batch_result['skipped']
+        result['existing'] += batch_result['existing']
+    return result
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, max_size=10, idle_timeout=300, timeout=10, check_interval=5, check=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # how long acquire() waits for a free connection when the pool is full
+        self.timeout = timeout
+        # connections idle for longer than this are checked before being handed out
+        self.check_interval = check_interval
+        self.check = check
+
+        self.idle = deque()
+        self.size = 0
+        self.condition = threading.Condition()
+        self.counters = {
+            'created': 0, 'reused': 0, 'closed': 0, 'expired': 0, 'health_check_failures': 0,
+            'waits': 0, 'wait_ms': 0.0, 'timeouts': 0,
+        }
+
+    def acquire(self, connect):
+        while True:
+            connection, released_at = self.checkout()
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self.forget()
+                    raise
+                with self.condition:
+                    self.counters['created'] += 1
+                return connection
+
+            if time.monotonic() - released_at < self.check_interval or self.is_healthy(connection):
+                with self.condition:
+                    self.counters['reused'] += 1
+                return connection
+            with self.condition:
+                self.counters['health_check_failures'] += 1
+            self.discard(connection)
+
+    def checkout(self):
+        # an idle connection and when it was released, or (None, None) when the caller may open a new one
+        started = time.monotonic()
+        with self.condition:
+            self.expire()
+            if not self.idle and self.size >= self.max_size:
+                self.counters['waits'] += 1
+                while not self.idle and self.size >= self.max_size:
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        raise PoolTimeout(f'no free database connection after {self.timeout}s, '
+                                          f'all {self.max_size} are in use')
+                    self.condition.wait(remaining)
+                    self.expire()
+                self.counters['wait_ms'] += (time.monotonic() - started) * 1000
+
+            if self.idle:
+                # the most recently used connection, so the surplus ones idle out
+                return self.idle.pop()
+            self.size += 1
+            return None, None
+
+    def release(self, connection):
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        self.close_connection(connection)
+        self.forget()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.counters['closed'] += 1
+            self.condition.notify()
+
+    def expire(self):
+        # the oldest idle connections are on the left
+        now = time.monotonic()
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            connection, _ = self.idle.popleft()
+            self.close_connection(connection)
+            self.size -= 1
+            self.counters['closed'] += 1
+            self.counters['expired'] += 1
+
+    def is_healthy(self, connection):
+        if self.check is None:
+            return True
+        try:
+            self.check(connection)
+        except Exception:
+            return False
+        return True
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.pop()
+                self.close_connection(connection)
+                self.size -= 1
+                self.counters['closed'] += 1
+
+    def stats(self):
+        with self.condition:
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'in_use': self.size - len(self.idle),
+                'idle': len(self.idle),
+                **self.counters,
+                'wait_ms': round(self.counters['wait_ms'], 2),
+            }
+
+
+pools = dict()
+pools_pid = os.getpid()
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, **options):
+    global pools_pid
+    with pools_lock:
+        # a forked worker must not share the sockets of its parent
+        if pools_pid != os.getpid():
+            pools.clear()
+            pools_pid = os.getpid()
+        if alias not in pools:
+            pools[alias] = ConnectionPool(**options)
+        return pools[alias]
+
+
+def pool_stats():
+    with pools_lock:
+        current = dict(pools) if pools_pid == os.getpid() else dict()
+    return {'pid': os.getpid(), 'pools': {alias: pool.stats() for alias, pool in current.items()}}
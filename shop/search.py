@@ -0,0 +1,91 @@
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Customer, CustomerSearchTerm
+
+
+PREFIX_MAX_LENGTH = 10
+PHONE_QUERY = re.compile(r'^[\d\s()+-]+$')
+
+
+def normalize(value):
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char)).lower()
+    return re.findall(r'\w+', value)
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def customer_tokens(customer):
+    tokens = set()
+    if customer.user_id:
+        tokens.update(normalize(customer.user.first_name))
+        tokens.update(normalize(customer.user.last_name))
+        tokens.update(normalize(customer.user.email))
+    tokens.update(normalize(customer.email))
+
+    phone_number = re.sub(r'\D', '', customer.phone_number or '')
+    if phone_number:
+        tokens.add(phone_number)
+    return tokens
+
+
+def customer_terms(customer):
+    terms = set()
+    for token in customer_tokens(customer):
+        for length in range(1, min(len(token), PREFIX_MAX_LENGTH) + 1):
+            terms.add((CustomerSearchTerm.KIND_PREFIX, token[:length]))
+        for trigram in trigrams(token):
+            terms.add((CustomerSearchTerm.KIND_TRIGRAM, trigram))
+    return terms
+
+
+def index_customers(customer_ids):
+    customers = Customer.objects.select_related('user').filter(pk__in=customer_ids)
+    with transaction.atomic():
+        CustomerSearchTerm.objects.filter(customer_id__in=customer_ids).delete()
+        CustomerSearchTerm.objects.bulk_create([
+            CustomerSearchTerm(customer_id=customer.id, kind=kind, term=term)
+            for customer in customers
+            for kind, term in customer_terms(customer)
+        ], batch_size=2000)
+
+
+def matching_customer_ids(token):
+    prefix_matches = CustomerSearchTerm.objects.filter(
+        kind=CustomerSearchTerm.KIND_PREFIX, term=token[:PREFIX_MAX_LENGTH]
+    ).values('customer_id')
+    if len(token) < 3:
+        return Q(pk__in=prefix_matches)
+
+    token_trigrams = trigrams(token)
+    trigram_matches = CustomerSearchTerm.objects.filter(kind=CustomerSearchTerm.KIND_TRIGRAM, term__in=token_trigrams) \
+        .values('customer_id') \
+        .annotate(matches=Count('term', distinct=True)) \
+        .filter(matches=len(token_trigrams)) \
+        .values('customer_id')
+    if len(token) > PREFIX_MAX_LENGTH:
+        return Q(pk__in=trigram_matches)
+    return Q(pk__in=prefix_matches) | Q(pk__in=trigram_matches)
+
+
+def query_tokens(query):
+    if PHONE_QUERY.match(query or ''):
+        return [re.sub(r'\D', '', query)]
+    return normalize(query)
+
+
+def search_customers(queryset, query, lookup='pk'):
+    tokens = list(dict.fromkeys(token for token in query_tokens(query) if token))
+    if not tokens:
+        return queryset
+
+    customer_ids = Customer.objects.all()
+    for token in tokens:
+        customer_ids = customer_ids.filter(matching_customer_ids(token))
+    return queryset.filter(**{f'{lookup}__in': customer_ids.values('pk')})
@@ -4,8 +4,11 @@ from django.utils.text import slugify
 from decimal import Decimal
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 
-from .models import Product, Category, Comment, Order, OrderItem, Cart, CartItem, Customer
+from .models import Product, Category, Comment, Order, OrderItem, Cart, CartItem, Customer, OrderStatusCount
+from .analytics import SALES_GROUPS, record_order_sales, track_order_sales
+from .transitions import transition_orders
 
 
 DOLLAR_TO_RIAL = 800000
@@ -21,6 +24,9 @@ class CategorySerializer(serializers.ModelSerializer):
 
     
     def get_number_of_products(self, category):
+        # annotated by the viewset queryset, a created or updated category is not
+        if hasattr(category, 'number_of_products'):
+            return category.number_of_products
         return category.products.count()
     
     def validate(self, data):
@@ -115,11 +121,24 @@ class CartItemSerializer(serializers.ModelSerializer):
         return cart_item.quantity * cart_item.product.unit_price
         
 
+class CachedProductField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        try:
+            product = Product.objects.cached(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
+
 class CartItemAddSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id','product', 'quantity']
 
+    product = CachedProductField(queryset=Product.objects.all())
+
     def create(self, validated_data):
         
         cart_pk = self.context['cart_pk']
@@ -133,7 +152,9 @@ class CartItemAddSerializer(serializers.ModelSerializer):
         except CartItem.DoesNotExist:
             cart_item = CartItem(**validated_data)
             cart_item.cart_id = self.context['cart_pk']
-            cart_item.save()
+            with transaction.atomic():
+                cart_item.save()
+                Cart.objects.add_items(cart_pk, 1)
         
         self.instance = cart_item
         return cart_item
@@ -151,13 +172,10 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id' ,'number_of_items', 'total_price', 'items']
         read_only_fields = ['id', 'items']
         
-    number_of_items = serializers.SerializerMethodField()
+    number_of_items = serializers.IntegerField(source='items_count', read_only=True)
     total_price = serializers.SerializerMethodField()
     items = CartItemSerializer(many=True, read_only=True)
     
-    def get_number_of_items(self, cart):
-        return cart.items.count()
-    
     def get_total_price(self, cart):
         return sum(item.quantity * item.product.unit_price for item in cart.items.all())
 
@@ -165,14 +183,39 @@ class CartSerializer(serializers.ModelSerializer):
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model =  Customer
-        fields = ['id', 'user', 'phone_number', 'birth_date', 'email', 'number_of_orders']
-        read_only_fields = ['user']
+        fields = ['id', 'user', 'phone_number', 'birth_date', 'email', 'number_of_orders', 'total_spent', 'last_order_at']
+        read_only_fields = ['user', 'total_spent', 'last_order_at']
         
-    number_of_orders = serializers.SerializerMethodField()
+    number_of_orders = serializers.IntegerField(source='orders_count', read_only=True)
+    
+
+
+class UserImportSerializer(serializers.Serializer):
+    username = serializers.CharField(max_length=150)
+    password = serializers.CharField(required=False, allow_blank=True, write_only=True)
+    email = serializers.EmailField(required=False, allow_blank=True)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    phone_number = serializers.CharField(max_length=250, required=False, allow_blank=True)
+    birth_date = serializers.DateField(required=False, allow_null=True)
+    province = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    city = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    address_detail = serializers.CharField(required=False, allow_blank=True)
 
-    def get_number_of_orders(self, customer):
-        return customer.orders.count()
+
+class EmailSerializer(serializers.Serializer):
+    subject = serializers.CharField(max_length=255)
+    body = serializers.CharField()
+
+
+class EmailCampaignSerializer(EmailSerializer):
+    customer_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filter = serializers.DictField(required=False)
     
+    def validate(self, data):
+        if 'customer_ids' not in data and 'filter' not in data:
+            raise serializers.ValidationError('Send customer_ids or a filter .')
+        return data
 
 
 class ProductForOrderSerializer(serializers.ModelSerializer):
@@ -182,12 +225,35 @@ class ProductForOrderSerializer(serializers.ModelSerializer):
 
 
     
+class ProductPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    # writes take a product id, reads show the product like ProductForOrderSerializer
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.product_serializer = ProductForOrderSerializer()
+
+    def use_pk_only_optimization(self):
+        return False
+
+    def to_representation(self, product):
+        return self.product_serializer.to_representation(product)
+
+    def to_internal_value(self, data):
+        # products loaded in bulk by the parent serializer, one query for all the items
+        products = self.context.get('products')
+        if products is not None:
+            try:
+                return products[int(data)]
+            except (TypeError, ValueError, KeyError):
+                pass
+        return super().to_internal_value(data)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:    
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'unit_price']
         
-        product = ProductSerializer()
+    product = ProductPrimaryKeyField(queryset=Product.objects.all())
 
 
 
@@ -211,26 +277,20 @@ class CustomerForOrderSerializer(serializers.ModelSerializer):
 class OrderForAdminSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'status', 'number_of_items', 'items']
+        fields = ['id', 'customer', 'status', 'number_of_items', 'total_amount', 'items']
         
-    number_of_items = serializers.SerializerMethodField()
+    number_of_items = serializers.IntegerField(source='items_count', read_only=True)
     items = OrderItemSerializer(many=True)
     customer = CustomerForOrderSerializer()
 
-    def get_number_of_items(self, order):
-        return order.items.count()
-
 
 class OrderForUsersSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['id', 'status', 'number_of_items', 'items']
+        fields = ['id', 'status', 'number_of_items', 'total_amount', 'items']
         
-    number_of_items = serializers.SerializerMethodField()
+    number_of_items = serializers.IntegerField(source='items_count', read_only=True)
     items = OrderItemSerializer(many=True)
-
-    def get_number_of_items(self, order):
-        return order.items.count()
     
 
 class OrderCreateSerializer(serializers.Serializer):
@@ -248,9 +308,15 @@ class OrderCreateSerializer(serializers.Serializer):
     def save(self, **kwargs):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
-            customer = Customer.objects.get(user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
-            cart_items = CartItem.objects.select_related('product').filter(cart_id=cart_id).all()
+            customer = self.context.get('customer') or Customer.objects.cached_by_user(self.context['user_id']) \
+                or Customer.objects.get(user_id=self.context['user_id'])
+            cart_items = list(CartItem.objects.select_related('product').filter(cart_id=cart_id).all())
+            
+            order = Order.objects.create(
+                customer=customer,
+                items_count=len(cart_items),
+                total_amount=sum(item.quantity * item.product.unit_price for item in cart_items),
+            )
             
             order_items = list()
             for cart_item in cart_items:
@@ -263,6 +329,9 @@ class OrderCreateSerializer(serializers.Serializer):
                 order_items.append(order_item)
             
             OrderItem.objects.bulk_create(order_items)
+            record_order_sales([order.id])
+            OrderStatusCount.objects.adjust({order.status: 1})
+            Customer.objects.refresh_order_stats(Customer.objects.filter(pk=customer.pk))
             
             Cart.objects.get(id=cart_id).delete()
             
@@ -289,16 +358,125 @@ class OrderUpdateSerializer(serializers.ModelSerializer):
 
     items = OrderItemSerializer(many=True)
 
-    def update(self, instance, validated_data):
-        # به‌روزرسانی status
-        instance.status = validated_data.get('status', instance.status)
-        instance.save()
+    def to_internal_value(self, data):
+        items = data.get('items') if hasattr(data, 'get') else None
+        if isinstance(items, list):
+            product_ids = [item.get('product') for item in items if isinstance(item, dict)]
+            self.context['products'] = Product.objects.in_bulk(
+                [product_id for product_id in product_ids if str(product_id).isdigit()]
+            )
+        return super().to_internal_value(data)
+
+    def to_representation(self, order):
+        # the viewset drops the prefetched items after saving, load them again with their products
+        prefetch_related_objects([order], Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+        return super().to_representation(order)
+
+    def validate_status(self, status):
+        if self.instance and status != self.instance.status \
+                and not Order.can_transition(self.instance.status, status):
+            raise serializers.ValidationError(
+                f'Order status can not change from {self.instance.status} to {status} .')
+        return status
+
+    def validate_items(self, items):
+        product_ids = [item['product'].id for item in items]
+        if len(product_ids) != len(set(product_ids)):
+            raise serializers.ValidationError('Each product can appear only once in an order .')
+        return items
 
-        # به‌روزرسانی items
-        items_data = validated_data.get('items')
-        if items_data:
-            instance.items.all().delete()  # آیتم‌های قبلی رو پاک کن (اگه نیاز نیست، این رو حذف کن)
-            for item_data in items_data:
-                OrderItem.objects.create(order=instance, **item_data)
+    def update(self, instance, validated_data):
+        with transaction.atomic(), track_order_sales([instance.pk]):
+            # به‌روزرسانی status
+            previous_status = instance.status
+            instance.status = validated_data.get('status', instance.status)
+            update_fields = ['status']
+            if instance.status != previous_status:
+                OrderStatusCount.objects.adjust({previous_status: -1, instance.status: 1})
+
+            # به‌روزرسانی items
+            items_data = validated_data.get('items')
+            if items_data:
+                self.sync_items(instance, items_data)
+                update_fields += ['items_count', 'total_amount']
+
+            instance.save(update_fields=update_fields)
+            Customer.objects.refresh_order_stats(Customer.objects.filter(pk=instance.customer_id))
 
         return instance
+
+    def sync_items(self, order, items_data):
+        existing_items = {item.product_id: item for item in OrderItem.objects.filter(order=order)}
+
+        items_to_create = list()
+        items_to_update = list()
+        final_items = list()
+        for item_data in items_data:
+            product = item_data['product']
+            item = existing_items.pop(product.id, None)
+
+            if item is None:
+                item = OrderItem(order=order, **item_data)
+                items_to_create.append(item)
+            else:
+                quantity = item_data.get('quantity', item.quantity)
+                unit_price = item_data.get('unit_price', item.unit_price)
+                if (quantity, unit_price) != (item.quantity, item.unit_price):
+                    item.quantity = quantity
+                    item.unit_price = unit_price
+                    items_to_update.append(item)
+            final_items.append(item)
+
+        # whatever is left in existing_items is not in the payload anymore
+        if existing_items:
+            OrderItem.objects.filter(pk__in=[item.pk for item in existing_items.values()]).delete()
+        if items_to_update:
+            OrderItem.objects.bulk_update(items_to_update, ['quantity', 'unit_price'])
+        if items_to_create:
+            OrderItem.objects.bulk_create(items_to_create)
+
+        order.items_count = len(final_items)
+        order.total_amount = sum(item.quantity * item.unit_price for item in final_items)
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS)
+    
+    def save(self, **kwargs):
+        return transition_orders(self.validated_data['ids'], self.validated_data['status'], **kwargs)
+
+
+class OrderExportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS, required=False)
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    include_archived = serializers.BooleanField(default=False)
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    group_by = serializers.ChoiceField(choices=list(SALES_GROUPS), default='day')
+    
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start must be before end .')
+        return data
+
+
+class SalesReportSerializer(serializers.Serializer):
+    def to_representation(self, row):
+        data = {key: value for key, value in row.items() if not key.startswith(('quantity_', 'revenue_', 'total_'))}
+        data['quantity'] = row['total_quantity'] or 0
+        data['revenue'] = row['total_revenue'] or 0
+        data['paid_quantity'] = row[f'quantity_{Order.ORDER_STATUS_PAID}'] or 0
+        data['paid_revenue'] = row[f'revenue_{Order.ORDER_STATUS_PAID}'] or 0
+        data['by_status'] = {
+            status: {
+                'quantity': row[f'quantity_{status}'] or 0,
+                'revenue': row[f'revenue_{status}'] or 0,
+            } for status, _ in Order.ORDER_STATUS
+        }
+        return data
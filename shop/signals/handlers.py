@@ -1,11 +1,65 @@
 from django.db.models.signals import post_save,post_delete,post_migrate,post_init
 from django.dispatch import receiver
 from django.conf import settings
+from django.db import transaction
 
-from shop.models import Customer
+from shop.cache import object_cache
+from shop.models import Category, Customer, Product
+from shop.search import index_customers
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, instance, created, **kwargs):
     if created:
         Customer.objects.create(user=instance)
+
+
+CUSTOMER_SEARCH_FIELDS = {'user', 'email', 'phone_number'}
+USER_SEARCH_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+
+
+def touches(update_fields, fields):
+    # update_fields is None for a full save
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+@receiver(post_save, sender=Customer)
+def index_customer_for_search(sender, instance, update_fields=None, **kwargs):
+    if touches(update_fields, CUSTOMER_SEARCH_FIELDS):
+        index_customers([instance.pk])
+
+
+# logins save last_login alone, which must not reindex the customer
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_customer_of_user_for_search(sender, instance, created, update_fields=None, **kwargs):
+    if not created and touches(update_fields, USER_SEARCH_FIELDS):
+        index_customers(Customer.objects.filter(user=instance).values_list('id', flat=True))
+
+
+# cached objects are dropped once the change is committed, otherwise a concurrent
+# request could cache the old row again before the new one is visible
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    # the product may have moved between categories, their product counts change
+    transaction.on_commit(lambda: (object_cache.invalidate('product', instance.pk),
+                                   object_cache.invalidate_namespace('category')))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_category(sender, instance, **kwargs):
+    transaction.on_commit(lambda: object_cache.invalidate('category', instance.pk))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_customer(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        transaction.on_commit(lambda: object_cache.invalidate('customer', instance.user_id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_customer_of_user(sender, instance, **kwargs):
+    transaction.on_commit(lambda: object_cache.invalidate('customer', instance.pk))
@@ -0,0 +1,11 @@
+from django import template
+
+from shop.models import Order, OrderStatusCount
+
+register = template.Library()
+
+
+@register.simple_tag
+def order_status_counts():
+    counts = OrderStatusCount.objects.counts()
+    return [(label, counts.get(status, 0)) for status, label in Order.ORDER_STATUS]
@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import csv
+import os
+import random
+import re
+import smtplib
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, connections
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from .analytics import rebuild_daily_sales, sales_report
+from .models import Category, Product, Comment, Customer, Order, OrderItem, Cart, CartItem, OrderStatusCount, \
+    ArchivedOrder, EmailJob, AdminBulkJob, CustomerSearchTerm, DailyProductSales
+from .replicas import ReplicaRouter, routing_state, replica_aliases
+from .pool import ConnectionPool, PoolTimeout
+from .cache import TieredCache, object_cache
+from .search import search_customers
+from .mailing import deliver_batch
+from .bulk_jobs import queue_job, claim_next_job, run_job
+from .exports import order_lines_queryset, stream_queryset
+from .admin import EstimatedCountPaginator, OrderAdmin, ProductAdmin
+from .fake_data import (PopularitySampler, generate_in_chunks, generate_orders, popularity_samplers,
+                        request_mix)
+from .onboarding import import_users
+from .archive import OrderHistory
+from .transitions import TRANSITION_DONE, TRANSITION_UNCHANGED, TRANSITION_INVALID, TRANSITION_NOT_FOUND
+from .signals import orders_status_changed
+from .throttling import TokenBucketStore, bucket_store
+
+
+def normalize_sql(sql):
+    sql = re.sub(r'"s\d+_x\d+"', '"savepoint"', sql)
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    return re.sub(r'\((\?, )+\?\)', '(...)', sql)
+
+
+class ShopTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_user('admin', password='password', is_staff=True, is_superuser=True)
+        cls.user = User.objects.create_user('customer', password='password', first_name='Sara', last_name='Ahmadi')
+        cls.customer = Customer.objects.get_or_create(user=cls.user)[0]
+        OrderStatusCount.objects.rebuild()
+
+    def setUp(self):
+        self.clear_caches()
+
+    def clear_caches(self):
+        # the token buckets live in the cache, do not let earlier tests throttle this one,
+        # and budgets are about the uncached path
+        cache.clear()
+        object_cache.clear()
+
+    def create_dataset(self, size):
+        category = Category.objects.create(title=f'category {size}')
+        Product.objects.bulk_create([
+            Product(name=f'product {size}-{i}', slug=f'product-{size}-{i}', description='...', category=category,
+                    unit_price=10 + i, inventory=100)
+            for i in range(size)
+        ])
+        # mysql does not return the primary keys of bulk inserted rows
+        products = list(Product.objects.filter(category=category).order_by('id'))
+        Comment.objects.bulk_create([
+            Comment(product=product, name='reviewer', body='a comment', status=Comment.COMMENT_STATUS_APPROVED)
+            for product in products for _ in range(size)
+        ])
+
+        for _ in range(size):
+            order = Order.objects.create(customer=self.customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price) for product in products
+            ])
+        Order.objects.refresh_totals()
+        OrderStatusCount.objects.rebuild()
+        Customer.objects.refresh_order_stats()
+        rebuild_daily_sales()
+
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2) for product in products])
+        Cart.objects.refresh_items_count(Cart.objects.filter(pk=cart.pk))
+
+        return {
+            'category': category.id,
+            'product': products[0].id,
+            'products': [product.id for product in products],
+            'order': order.id,
+            'orders': list(Order.objects.filter(customer=self.customer).values_list('id', flat=True)),
+            'cart': cart.id,
+        }
+
+
+class QueryBudgetTestCase(ShopTestCase):
+    # dataset sizes every endpoint is called with, they stay under the page size
+    sizes = (2, 8)
+    # total sql time of one request
+    time_budget_ms = 200
+
+    def capture(self, user, request, dataset):
+        self.client.force_authenticate(user)
+        method, path, data = request(dataset)
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400, f'{method.upper()} {path} returned {response.status_code}: '
+                                                   f'{getattr(response, "data", "")}')
+        return context.captured_queries
+
+    def assertQueryBudget(self, user, request, time_budget_ms=None):
+        time_budget_ms = time_budget_ms or self.time_budget_ms
+        runs = list()
+        for size in self.sizes:
+            self.clear_caches()
+            queries = self.capture(user, request, self.create_dataset(size))
+            runs.append((size, queries))
+
+            sql_time = sum(float(query['time']) for query in queries) * 1000
+            self.assertLessEqual(sql_time, time_budget_ms, f'{sql_time:.1f}ms of SQL with {size} rows is over the '
+                                                           f'{time_budget_ms}ms budget:\n' + self.format_queries(queries))
+
+        (small_size, small), (large_size, large) = runs[0], runs[-1]
+        if len(small) != len(large):
+            grown = Counter(normalize_sql(query['sql']) for query in large)
+            grown.subtract(Counter(normalize_sql(query['sql']) for query in small))
+            offending = '\n'.join(f'  +{count} x {sql}' for sql, count in grown.items() if count > 0)
+            self.fail(f'{len(small)} queries with {small_size} rows but {len(large)} with {large_size} rows, '
+                      f'the extra queries are:\n{offending}\nall queries:\n' + self.format_queries(large))
+
+    def format_queries(self, queries):
+        return '\n'.join(f'  {float(query["time"]) * 1000:.2f}ms {query["sql"]}' for query in queries)
+
+
+class ProductQueryBudgetTest(QueryBudgetTestCase):
+    def test_product_list(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', '/products/', None))
+
+    def test_product_list_by_category(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', '/products/', {'category': dataset['category']}))
+
+    def test_product_detail(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', f'/products/{dataset["product"]}/', None))
+
+    def test_product_comments(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', f'/products/{dataset["product"]}/comments/', None))
+
+    def test_category_list(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', '/category/', None))
+
+    def test_category_detail(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', f'/category/{dataset["category"]}/', None))
+
+    def test_product_create(self):
+        self.assertQueryBudget(self.admin, lambda dataset: ('post', '/products/', {
+            'name': f'new product {dataset["category"]}', 'body': '...', 'category': dataset['category'],
+            'price': '9.99', 'inventory': 5,
+        }))
+
+    def test_product_update(self):
+        self.assertQueryBudget(self.admin, lambda dataset: (
+            'patch', f'/products/{dataset["product"]}/', {'price': '19.99', 'inventory': 7}))
+
+    def test_product_delete(self):
+        # products with order items cannot be deleted
+        def request(dataset):
+            product = Product.objects.create(name='unsold product', slug='unsold-product', description='...',
+                                             category_id=dataset['category'], unit_price=1, inventory=1)
+            return 'delete', f'/products/{product.id}/', None
+        self.assertQueryBudget(self.admin, request)
+
+    def test_category_create(self):
+        self.assertQueryBudget(self.admin, lambda dataset: ('post', '/category/', {'name': 'new category'}))
+
+    def test_category_update(self):
+        self.assertQueryBudget(self.admin, lambda dataset: (
+            'patch', f'/category/{dataset["category"]}/', {'name': 'renamed category'}))
+
+    def test_category_delete(self):
+        # categories with products cannot be deleted
+        def request(dataset):
+            return 'delete', f'/category/{Category.objects.create(title="empty category").id}/', None
+        self.assertQueryBudget(self.admin, request)
+
+    def test_comment_create(self):
+        self.assertQueryBudget(self.user, lambda dataset: (
+            'post', f'/products/{dataset["product"]}/comments/', {'name': 'reviewer', 'text': 'a new comment'}))
+
+    def test_comment_update(self):
+        def request(dataset):
+            comment = Comment.objects.filter(product_id=dataset['product']).first()
+            return 'patch', f'/products/{dataset["product"]}/comments/{comment.id}/', {'text': 'an edited comment'}
+        self.assertQueryBudget(self.admin, request)
+
+    def test_comment_delete(self):
+        def request(dataset):
+            comment = Comment.objects.filter(product_id=dataset['product']).first()
+            return 'delete', f'/products/{dataset["product"]}/comments/{comment.id}/', None
+        self.assertQueryBudget(self.admin, request)
+
+
+class CartQueryBudgetTest(QueryBudgetTestCase):
+    def test_cart_detail(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', f'/carts/{dataset["cart"]}/', None))
+
+    def test_cart_items(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', f'/carts/{dataset["cart"]}/items/', None))
+
+    def test_cart_add_item(self):
+        self.assertQueryBudget(self.user, lambda dataset: (
+            'post', f'/carts/{dataset["cart"]}/items/', {'product': dataset['product'], 'quantity': 1}))
+
+    def test_cart_create(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('post', '/carts/', {}))
+
+    def test_cart_item_update(self):
+        def request(dataset):
+            item = CartItem.objects.filter(cart_id=dataset['cart']).first()
+            return 'patch', f'/carts/{dataset["cart"]}/items/{item.id}/', {'quantity': 5}
+        self.assertQueryBudget(self.user, request)
+
+    def test_cart_item_delete(self):
+        def request(dataset):
+            item = CartItem.objects.filter(cart_id=dataset['cart']).first()
+            return 'delete', f'/carts/{dataset["cart"]}/items/{item.id}/', None
+        self.assertQueryBudget(self.user, request)
+
+
+class CustomerQueryBudgetTest(QueryBudgetTestCase):
+    def test_customer_list(self):
+        self.assertQueryBudget(self.admin, lambda dataset: ('get', '/customers/', None))
+
+    def test_customer_me(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', '/customers/me/', None))
+
+    def test_customer_detail(self):
+        self.assertQueryBudget(self.admin, lambda dataset: ('get', f'/customers/{self.customer.id}/', None))
+
+    def test_customer_update(self):
+        self.assertQueryBudget(self.admin, lambda dataset: (
+            'patch', f'/customers/{self.customer.id}/', {'phone_number': '09120000000'}))
+
+
+class OrderQueryBudgetTest(QueryBudgetTestCase):
+    def test_order_list_for_admin(self):
+        self.assertQueryBudget(self.admin, lambda dataset: ('get', '/orders/', None))
+
+    def test_order_list_for_customer(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', '/orders/', None))
+
+    def test_order_detail(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', f'/orders/{dataset["order"]}/', None))
+
+    def test_order_history(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('get', '/orders/history/', None))
+
+    def test_order_status_counts(self):
+        self.assertQueryBudget(self.admin, lambda dataset: ('get', '/orders/status_counts/', None))
+
+    def test_checkout(self):
+        self.assertQueryBudget(self.user, lambda dataset: ('post', '/orders/', {'cart_id': str(dataset['cart'])}))
+
+    def test_order_update(self):
+        self.assertQueryBudget(self.admin, lambda dataset: (
+            'patch', f'/orders/{dataset["order"]}/', {
+                'status': Order.ORDER_STATUS_PAID,
+                'items': [{'product': product_id, 'quantity': 2, 'unit_price': '5.00'}
+                          for product_id in dataset['products']],
+            }))
+
+    def test_order_delete(self):
+        # orders with items are protected
+        def request(dataset):
+            return 'delete', f'/orders/{Order.objects.create(customer=self.customer).id}/', None
+        self.assertQueryBudget(self.admin, request)
+
+    def test_order_transition(self):
+        self.assertQueryBudget(self.admin, lambda dataset: (
+            'post', '/orders/transition/', {'ids': dataset['orders'][-len(dataset['products']):],
+                                            'status': Order.ORDER_STATUS_CANCELED}))
+
+    def test_sales_analytics(self):
+        today = date.today()
+        self.assertQueryBudget(self.admin, lambda dataset: (
+            'get', '/analytics/sales/', {'start': today - timedelta(days=7), 'end': today}))
+
+
+@override_settings(DATABASES={**settings.DATABASES, 'replica_1': {}, 'replica_2': {}})
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.state = {'replica': True, 'wrote': False}
+        self.token = routing_state.set(self.state)
+
+    def tearDown(self):
+        routing_state.reset(self.token)
+
+    def test_reads_go_to_a_replica(self):
+        self.assertIn(self.router.db_for_read(Product), ['replica_1', 'replica_2'])
+
+    def test_reads_outside_replica_views_stay_on_primary(self):
+        self.state['replica'] = False
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_outside_a_request_stay_on_primary(self):
+        routing_state.set(None)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_write(Order), 'default')
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+
+@skipUnless(replica_aliases(), 'no replica databases configured')
+class ReplicaRoutingTest(APITransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        object_cache.clear()
+        self.admin = get_user_model().objects.create_user('admin', password='password', is_staff=True)
+        Category.objects.create(title='category')
+
+    def get(self, path):
+        with ExitStack() as stack:
+            primary = stack.enter_context(CaptureQueriesContext(connection))
+            replicas = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in replica_aliases()]
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(primary), sum(len(context) for context in replicas)
+
+    def test_catalog_reads_use_the_replica(self):
+        primary, replica = self.get('/category/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_other_reads_stay_on_primary(self):
+        self.client.force_authenticate(self.admin)
+        primary, replica = self.get('/customers/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/category/', {'name': 'new category', 'description': '...'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        primary, replica = self.get('/category/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        cache.clear()
+        primary, replica = self.get('/category/')
+        self.assertGreater(replica, 0)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def connect(self):
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def test_released_connections_are_reused(self):
+        pool = ConnectionPool(max_size=2)
+        first = pool.acquire(self.connect)
+        pool.release(first)
+        self.assertIs(pool.acquire(self.connect), first)
+        self.assertEqual((pool.stats()['created'], pool.stats()['reused'], pool.stats()['in_use']), (1, 1, 1))
+
+    def test_full_pool_times_out(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+        self.assertEqual((pool.stats()['waits'], pool.stats()['timeouts']), (1, 1))
+
+    def test_waiters_get_released_connections(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        connection = pool.acquire(self.connect)
+        threading.Timer(0.05, pool.release, [connection]).start()
+        self.assertIs(pool.acquire(self.connect), connection)
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_idle_connections_expire(self):
+        pool = ConnectionPool(idle_timeout=0)
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        self.assertIsNot(pool.acquire(self.connect), connection)
+        self.assertEqual((pool.stats()['expired'], pool.stats()['size']), (1, 1))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute('SELECT 1')
+
+    def test_broken_connections_are_replaced(self):
+        pool = ConnectionPool(check_interval=0, check=lambda connection: connection.execute('SELECT 1'))
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        connection.close()
+        self.assertIsNot(pool.acquire(self.connect), connection)
+        self.assertEqual((pool.stats()['health_check_failures'], pool.stats()['size']), (1, 1))
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # two workers sharing the default cache
+        self.first = TieredCache(sync_interval=0, ttls={'product': 60})
+        self.second = TieredCache(sync_interval=0, ttls={'product': 60})
+
+    def test_lookups_go_local_then_shared_then_loader(self):
+        self.assertEqual(self.first.get_or_load('product', 1, lambda: 'loaded'), 'loaded')
+        self.assertEqual(self.first.get_or_load('product', 1, lambda: 'reloaded'), 'loaded')
+        self.assertEqual(self.second.get_or_load('product', 1, lambda: 'reloaded'), 'loaded')
+        self.assertEqual(self.first.stats()['namespaces']['product']['local_hits'], 1)
+        self.assertEqual(self.second.stats()['namespaces']['product']['shared_hits'], 1)
+
+    def test_missing_objects_are_not_cached(self):
+        self.assertIsNone(self.first.get_or_load('product', 1, lambda: None))
+        self.assertEqual(self.first.get_or_load('product', 1, lambda: 'loaded'), 'loaded')
+
+    def test_invalidations_reach_other_workers(self):
+        for worker in [self.first, self.second]:
+            worker.get_or_load('product', 1, lambda: 'old')
+            worker.get_or_load('product', 2, lambda: 'old')
+        self.first.invalidate('product', 1)
+        self.assertEqual(self.second.get_or_load('product', 1, lambda: 'new'), 'new')
+        self.assertEqual(self.second.get_or_load('product', 2, lambda: 'new'), 'old')
+
+    def test_namespace_invalidation_bumps_the_version(self):
+        for worker in [self.first, self.second]:
+            worker.get_or_load('product', 1, lambda: 'old')
+        self.first.invalidate_namespace('product')
+        self.assertEqual(self.second.get_or_load('product', 1, lambda: 'new'), 'new')
+        self.assertEqual(self.first.get_or_load('product', 1, lambda: 'newer'), 'new')
+
+    def test_lost_invalidations_clear_the_local_cache(self):
+        self.second.get_or_load('product', 1, lambda: 'old')
+        self.first.invalidate('product', 1)
+        cache.delete(self.first.log_key(1))
+        self.second.local.set(('product', '1'), 'stale')
+        self.assertEqual(self.second.get_or_load('product', 1, lambda: 'new'), 'new')
+        self.assertEqual(self.second.stats()['resets'], 1)
+
+
+class ObjectCacheTest(ShopTestCase):
+    def test_product_detail_is_served_from_the_cache(self):
+        dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.user)
+        self.client.get(f'/products/{dataset["product"]}/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/products/{dataset["product"]}/')
+        self.assertEqual(response.data['id'], dataset['product'])
+        self.assertEqual(len(context), 0)
+
+    def test_saving_a_product_invalidates_it(self):
+        dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.user)
+        self.client.get(f'/products/{dataset["product"]}/')
+        product = Product.objects.get(pk=dataset['product'])
+        product.inventory = 42
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.client.get(f'/products/{dataset["product"]}/').data['inventory'], 42)
+
+    def test_checkout_invalidates_the_customer(self):
+        dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.user)
+        orders_count = self.client.get('/customers/me/').data['number_of_orders']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/orders/', {'cart_id': str(dataset['cart'])}, format='json')
+        self.assertEqual(self.client.get('/customers/me/').data['number_of_orders'], orders_count + 1)
+
+
+class OrderTotalsTest(ShopTestCase):
+    def test_checkout_stores_the_totals(self):
+        dataset = self.create_dataset(3)
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/orders/', {'cart_id': str(dataset['cart'])}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        order = Order.objects.get(pk=response.data['id'])
+        # three products of 10, 11 and 12, two of each in the cart
+        self.assertEqual((order.items_count, order.total_amount), (3, Decimal('66.00')))
+        self.assertEqual((response.data['number_of_items'], Decimal(str(response.data['total_amount']))),
+                         (3, Decimal('66.00')))
+
+    def test_items_show_their_product(self):
+        dataset = self.create_dataset(1)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/orders/{dataset["order"]}/')
+        self.assertEqual(response.data['items'][0]['product'], {'id': dataset['product'], 'name': 'product 1-0'})
+
+    def test_updating_items_refreshes_the_totals(self):
+        dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.admin)
+        response = self.client.patch(f'/orders/{dataset["order"]}/', {
+            'items': [{'product': dataset['product'], 'quantity': 3, 'unit_price': '5.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        order = Order.objects.get(pk=dataset['order'])
+        self.assertEqual((order.items_count, order.total_amount), (1, Decimal('15.00')))
+
+    def patch_items(self, size):
+        dataset = self.create_dataset(size)
+        unchanged, changed, removed, *others = dataset['products']
+        added = Product.objects.create(name='added product', slug='added-product', description='...',
+                                       category_id=dataset['category'], unit_price=7, inventory=10)
+        items = dict(OrderItem.objects.filter(order_id=dataset['order']).values_list('product_id', 'id'))
+
+        payload = [{'product': product_id, 'quantity': 1, 'unit_price': str(10 + i)}
+                   for i, product_id in enumerate(dataset['products']) if product_id not in (changed, removed)]
+        payload += [{'product': changed, 'quantity': 4, 'unit_price': '11.00'},
+                    {'product': added.id, 'quantity': 2, 'unit_price': '7.00'}]
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/orders/{dataset["order"]}/', {'items': payload}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        after = dict(OrderItem.objects.filter(order_id=dataset['order']).values_list('product_id', 'id'))
+        return items, after, (unchanged, changed, removed, added.id), context.captured_queries
+
+    def test_updating_items_diffs_them(self):
+        before, after, (unchanged, changed, removed, added), queries = self.patch_items(3)
+        self.assertEqual(after[unchanged], before[unchanged])
+        self.assertEqual(after[changed], before[changed])
+        self.assertNotIn(removed, after)
+        self.assertIn(added, after)
+
+        def item_ids(statement):
+            sqls = [query['sql'] for query in queries if query['sql'].startswith(statement)]
+            return {int(item_id) for sql in sqls for item_id in re.findall(r'"id" = (\d+)|IN \(([\d, ]+)\)', sql)
+                    for item_id in ' '.join(item_id).replace(',', ' ').split()}
+        # the bulk update touches the changed row only, the delete the removed one only
+        self.assertEqual(item_ids('UPDATE "shop_orderitem"'), {before[changed]})
+        self.assertEqual(item_ids('DELETE FROM "shop_orderitem"'), {before[removed]})
+
+        self.assertEqual(len(self.patch_items(6)[3]), len(queries))
+
+    def test_migration_backfills_the_totals(self):
+        dataset = self.create_dataset(2)
+        Order.objects.update(items_count=0, total_amount=0)
+        migration = import_module('shop.migrations.0013_order_items_count_total_amount')
+        migration.populate_order_totals(django_apps, None)
+
+        order = Order.objects.get(pk=dataset['order'])
+        self.assertEqual((order.items_count, order.total_amount), (2, Decimal('21.00')))
+
+
+class CustomerOrderStatsTest(ShopTestCase):
+    def test_stats_cover_hot_and_archived_orders(self):
+        self.create_dataset(2)
+        newest = timezone.now() + timedelta(days=1)
+        # archived after a backdated hot order was placed
+        ArchivedOrder.objects.create(id=10 ** 6, customer=self.customer, datetime_created=newest,
+                                     status=Order.ORDER_STATUS_PAID, items_count=1, total_amount=Decimal('4.00'))
+        ArchivedOrder.objects.create(id=10 ** 6 + 1, customer=self.customer, datetime_created=newest,
+                                     status=Order.ORDER_STATUS_CANCELED, items_count=1, total_amount=Decimal('9.00'))
+
+        Customer.objects.refresh_order_stats(Customer.objects.filter(pk=self.customer.pk))
+        customer = Customer.objects.get(pk=self.customer.pk)
+        # two hot orders of 21.00, the canceled one does not count towards the spend
+        self.assertEqual((customer.orders_count, customer.total_spent, customer.last_order_at),
+                         (4, Decimal('46.00'), newest))
+
+    def test_migration_backfills_the_stats(self):
+        self.create_dataset(2)
+        Customer.objects.update(orders_count=0, total_spent=0, last_order_at=None)
+        migration = import_module('shop.migrations.0017_customer_order_stats')
+        migration.populate_customer_order_stats(django_apps, None)
+
+        customer = Customer.objects.get(pk=self.customer.pk)
+        last_order = Order.objects.filter(customer=self.customer).latest('datetime_created')
+        self.assertEqual((customer.orders_count, customer.total_spent, customer.last_order_at),
+                         (2, Decimal('42.00'), last_order.datetime_created))
+
+
+class CartItemsCountTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.user)
+
+    def assertItemsCount(self, count):
+        self.assertEqual(Cart.objects.get(pk=self.dataset['cart']).items_count, count)
+        response = self.client.get(f'/carts/{self.dataset["cart"]}/')
+        self.assertEqual(response.data['number_of_items'], count)
+
+    def test_adding_a_product_counts_it_once(self):
+        product = Product.objects.create(name='another product', slug='another-product', description='...',
+                                         category_id=self.dataset['category'], unit_price=5, inventory=10)
+        url = f'/carts/{self.dataset["cart"]}/items/'
+        self.client.post(url, {'product': product.id, 'quantity': 1})
+        self.assertItemsCount(3)
+
+        # the same product again only raises its quantity
+        self.client.post(url, {'product': product.id, 'quantity': 2})
+        self.assertItemsCount(3)
+        self.assertEqual(CartItem.objects.get(cart_id=self.dataset['cart'], product=product).quantity, 3)
+
+    def test_changing_the_quantity_keeps_the_count(self):
+        item = CartItem.objects.filter(cart_id=self.dataset['cart']).first()
+        response = self.client.patch(f'/carts/{self.dataset["cart"]}/items/{item.id}/', {'quantity': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertItemsCount(2)
+
+    def test_deleting_an_item_uncounts_it(self):
+        items = list(CartItem.objects.filter(cart_id=self.dataset['cart']))
+        for count, item in enumerate(items):
+            response = self.client.delete(f'/carts/{self.dataset["cart"]}/items/{item.id}/')
+            self.assertEqual(response.status_code, 204)
+            self.assertItemsCount(len(items) - count - 1)
+
+    def test_reconcile_restores_the_count(self):
+        Cart.objects.update(items_count=9)
+        empty_cart = Cart.objects.create(items_count=4)
+        call_command('reconcile_order_totals', stdout=StringIO())
+
+        self.assertItemsCount(2)
+        self.assertEqual(Cart.objects.get(pk=empty_cart.pk).items_count, 0)
+
+    def test_migration_backfills_the_count(self):
+        Cart.objects.update(items_count=0)
+        migration = import_module('shop.migrations.0021_cart_items_count')
+        migration.populate_cart_items_count(django_apps, None)
+        self.assertItemsCount(2)
+
+
+class OrderStatusCountTest(ShopTestCase):
+    def test_counters_change_after_the_commit(self):
+        dataset = self.create_dataset(2)
+        before = OrderStatusCount.objects.counts()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post('/orders/', {'cart_id': str(dataset['cart'])}, format='json')
+        # the counter row is left alone while the checkout transaction is open
+        self.assertEqual(OrderStatusCount.objects.counts(), before)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(OrderStatusCount.objects.counts()[Order.ORDER_STATUS_UNPAID],
+                         before[Order.ORDER_STATUS_UNPAID] + 1)
+
+    def test_deleting_an_order_updates_the_counters(self):
+        # orders with items are protected
+        order = Order.objects.create(customer=self.customer)
+        before = OrderStatusCount.objects.rebuild()
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/orders/{order.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(OrderStatusCount.objects.counts()[Order.ORDER_STATUS_UNPAID],
+                         before[Order.ORDER_STATUS_UNPAID] - 1)
+
+
+class UserImportTest(ShopTestCase):
+    def test_bulk_import(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/customers/bulk_import/', [
+            {'username': 'sara', 'password': 'a-long-password', 'first_name': 'Sara', 'phone_number': '0912',
+             'province': 'Tehran', 'city': 'Tehran', 'address_detail': 'street 1'},
+            {'username': 'reza', 'password': ''},
+            # taken already
+            {'username': 'customer', 'password': 'a-long-password'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 2, 'skipped': 1, 'existing': ['customer']})
+
+        User = get_user_model()
+        sara, reza = User.objects.get(username='sara'), User.objects.get(username='reza')
+        self.assertTrue(sara.check_password('a-long-password'))
+        self.assertFalse(reza.has_usable_password())
+        self.assertEqual(sara.customer.phone_number, '0912')
+        self.assertEqual(sara.customer.address.city, 'Tehran')
+        self.assertTrue(Customer.objects.filter(user=reza).exists())
+        self.assertEqual(Customer.objects.filter(user=self.user).count(), 1)
+
+    def test_existing_users_without_a_customer_are_left_alone(self):
+        # bulk_create sends no post_save, so this user has no customer
+        get_user_model().objects.bulk_create([get_user_model()(username='nima')])
+        result = import_users([{'username': 'nima', 'password': '', 'city': 'Tehran', 'province': 'Tehran',
+                                'address_detail': 'street 1'}])
+        self.assertEqual(result, {'created': 0, 'skipped': 1, 'existing': ['nima']})
+        self.assertFalse(Customer.objects.filter(user__username='nima').exists())
+
+    @override_settings(USER_IMPORT_MAX_ROWS=2)
+    def test_bulk_import_is_capped(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/customers/bulk_import/', [{'username': f'user{i}'} for i in range(3)],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(get_user_model().objects.filter(username__startswith='user').exists())
+
+    def test_import_command_reads_blank_csv_passwords_as_unusable(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('username,password,email\nnima,,nima@example.com\n')
+        self.addCleanup(os.remove, file.name)
+        call_command('import_users', file.name, workers=1, stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.get(username='nima').has_usable_password())
+
+
+class CustomerSearchTest(ShopTestCase):
+    def test_search_by_name(self):
+        self.assertEqual(list(search_customers(Customer.objects.all(), 'sar ahmad')), [self.customer])
+        self.assertFalse(search_customers(Customer.objects.all(), 'reza').exists())
+
+    def test_blank_query_does_not_filter(self):
+        self.assertEqual(search_customers(Customer.objects.all(), ' - ').count(), Customer.objects.count())
+
+    def test_migration_backfills_the_index(self):
+        CustomerSearchTerm.objects.all().delete()
+        migration = import_module('shop.migrations.0018_customer_search_term')
+        migration.populate_customer_search_terms(django_apps, None)
+        self.assertEqual(list(search_customers(Customer.objects.all(), 'ahmadi')), [self.customer])
+
+    def test_logins_do_not_reindex(self):
+        self.user.first_name = 'Reza'
+        self.user.save(update_fields=['last_login'])
+        self.assertFalse(search_customers(Customer.objects.all(), 'reza').exists())
+
+        self.user.save(update_fields=['first_name'])
+        self.assertEqual(list(search_customers(Customer.objects.all(), 'reza')), [self.customer])
+
+
+class UnreachableEmailBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('connection refused')
+
+
+class DroppingEmailBackend(locmem.EmailBackend):
+    # the server goes away after the first message
+    def send_messages(self, messages):
+        if mail.outbox:
+            raise smtplib.SMTPServerDisconnected('connection unexpectedly closed')
+        return super().send_messages(messages)
+
+
+class CustomerEmailTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.email = 'sara@example.com'
+        self.user.save(update_fields=['email'])
+        self.client.force_authenticate(self.admin)
+
+    def test_post_queues_and_delivery_sends(self):
+        response = self.client.post(f'/customers/{self.customer.id}/sending_email/', {'subject': 'hi', 'body': '...'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data, {'queued': 1})
+
+        with patch('shop.mailing.time.sleep') as sleep:
+            self.assertEqual(deliver_batch(rate_limit=0), {'sent': 1, 'failed': 0, 'unattempted': 0})
+        sleep.assert_not_called()
+        self.assertEqual(mail.outbox[0].to, ['sara@example.com'])
+
+    def queue(self, count):
+        EmailJob.objects.bulk_create([
+            EmailJob(customer=self.customer, to_email='sara@example.com', subject='hi', body='...') for _ in range(count)
+        ])
+        return list(EmailJob.objects.order_by('id').values_list('id', flat=True))
+
+    @override_settings(EMAIL_BACKEND='shop.tests.UnreachableEmailBackend')
+    def test_failing_to_connect_counts_an_attempt(self):
+        job_id = self.queue(1)[0]
+        self.assertEqual(deliver_batch(rate_limit=0, max_attempts=2), {'sent': 0, 'failed': 1, 'unattempted': 0})
+        job = EmailJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.attempts, job.last_error), (EmailJob.EMAIL_STATUS_PENDING, 1, 'connection refused'))
+
+        EmailJob.objects.update(next_attempt_at=timezone.now())
+        deliver_batch(rate_limit=0, max_attempts=2)
+        self.assertEqual(EmailJob.objects.get(pk=job_id).status, EmailJob.EMAIL_STATUS_FAILED)
+
+    @override_settings(EMAIL_BACKEND='shop.tests.DroppingEmailBackend')
+    def test_a_dropped_connection_leaves_the_rest_unattempted(self):
+        first, second, third = self.queue(3)
+        self.assertEqual(deliver_batch(rate_limit=0), {'sent': 1, 'failed': 1, 'unattempted': 1})
+
+        jobs = EmailJob.objects.in_bulk()
+        self.assertEqual((jobs[first].status, jobs[second].attempts, jobs[third].attempts),
+                         (EmailJob.EMAIL_STATUS_SENT, 1, 0))
+        # released right away instead of waiting out the claim
+        self.assertLessEqual(jobs[third].next_attempt_at, timezone.now())
+
+    def test_get_is_still_answered(self):
+        response = self.client.get(f'/customers/{self.customer.id}/sending_email/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Deprecation'], 'true')
+        self.assertFalse(EmailJob.objects.exists())
+
+
+class AdminBulkJobTest(ShopTestCase):
+    def inventories(self, product_ids):
+        return list(Product.objects.filter(pk__in=product_ids).order_by('id').values_list('inventory', flat=True))
+
+    def test_jobs_run_over_the_selected_rows(self):
+        products = self.create_dataset(3)['products']
+        job = queue_job('clear_inventory', Product.objects.filter(pk__in=products[:2]))
+        run_job(claim_next_job(), chunk_size=1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total_chunks, job.rows_affected), (AdminBulkJob.JOB_STATUS_DONE, 2, 2))
+        self.assertEqual(self.inventories(products), [0, 0, 100])
+
+    def test_select_across_keeps_the_changelist_filters(self):
+        products = self.create_dataset(3)['products']
+        dataset = self.create_dataset(2)
+        self.client.force_login(self.admin)
+        response = self.client.post(f'/admin/shop/product/?category__id__exact={dataset["category"]}&p=1', {
+            'action': 'clear_inventory', '_selected_action': dataset['products'][:1], 'select_across': '1', 'index': 0,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        job = AdminBulkJob.objects.get()
+        self.assertIsNone(job.object_ids)
+        self.assertEqual((job.first_pk, job.last_pk), (products[0], dataset['products'][-1]))
+        run_job(claim_next_job(), chunk_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total_chunks, job.rows_affected), (AdminBulkJob.JOB_STATUS_DONE, 3, 2))
+        self.assertEqual(self.inventories(products + dataset['products']), [100, 100, 100, 0, 0])
+
+    def test_stale_running_jobs_are_resumed(self):
+        products = self.create_dataset(3)['products']
+        job = queue_job('clear_inventory', Product.objects.filter(pk__in=products))
+        AdminBulkJob.objects.filter(pk=job.pk).update(
+            status=AdminBulkJob.JOB_STATUS_RUNNING, total_chunks=3, done_chunks=1,
+            datetime_heartbeat=timezone.now() - timedelta(hours=1),
+        )
+        self.assertIsNone(claim_next_job(stale_after=timedelta(hours=2)))
+
+        run_job(claim_next_job(), chunk_size=1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done_chunks, job.rows_affected), (AdminBulkJob.JOB_STATUS_DONE, 3, 2))
+        # the chunk of the lost worker is not run again
+        self.assertEqual(self.inventories(products), [100, 0, 0])
+
+
+class OrderExportTest(ShopTestCase):
+    def test_streamed_rows_match_the_queryset(self):
+        # on mysql the rows come from a raw server side cursor, they go through the same converters
+        self.create_dataset(2)
+        queryset = order_lines_queryset()
+        self.assertEqual(list(stream_queryset(queryset, chunk_size=3)), list(queryset))
+        self.assertEqual(list(stream_queryset(queryset.none())), [])
+
+    def test_date_range_includes_whole_days_on_the_raw_column(self):
+        dataset = self.create_dataset(1)
+        today = timezone.localdate()
+        order = Order.objects.get(pk=dataset['order'])
+        order.datetime_created = timezone.make_aware(datetime.combine(today - timedelta(days=1), time(23, 59)))
+        order.save(update_fields=['datetime_created'])
+
+        queryset = order_lines_queryset(start=today - timedelta(days=1), end=today - timedelta(days=1))
+        self.assertEqual([row[0] for row in queryset], [order.id])
+        self.assertFalse(order_lines_queryset(start=today, end=today).exists())
+        self.assertFalse(order_lines_queryset(end=today - timedelta(days=2)).exists())
+        # no date cast of the column, which could not use its index
+        self.assertNotIn('cast_date', str(queryset.query).lower())
+
+
+class AdminCsvExportTest(ShopTestCase):
+    def export(self, url, selected, select_across=False):
+        self.client.force_login(self.admin)
+        data = {'action': 'export_as_csv', '_selected_action': selected, 'index': 0}
+        if select_across:
+            data['select_across'] = '1'
+        response = self.client.post(url, data)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        # the rows are read lazily, while the response streams
+        with CaptureQueriesContext(connection) as context:
+            content = b''.join(response.streaming_content).decode()
+        return list(csv.reader(StringIO(content))), len(context.captured_queries)
+
+    @patch.object(OrderAdmin, 'export_chunk_size', 2)
+    def test_orders_export(self):
+        orders = sorted(self.create_dataset(3)['orders'])
+        rows, queries = self.export('/admin/shop/order/', orders[:2])
+
+        self.assertEqual(rows[0], ['ID', 'customer', 'status', 'date of created', 'Number of items'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(order_id) for order_id in orders[:2]])
+        self.assertEqual(rows[1][1:3], ['Sara Ahmadi', 'Unpaid'])
+        self.assertEqual(rows[1][4], '3')
+        # one query per chunk, plus the empty one that ends the keyset pagination
+        self.assertEqual(queries, 2)
+
+        rows, queries = self.export('/admin/shop/order/', orders[:1], select_across=True)
+        self.assertEqual([row[0] for row in rows[1:]], [str(order_id) for order_id in orders])
+        self.assertEqual(queries, 3)
+
+    @patch.object(ProductAdmin, 'export_chunk_size', 2)
+    def test_products_export(self):
+        self.create_dataset(2)
+        dataset = self.create_dataset(5)
+        rows, queries = self.export('/admin/shop/product/', dataset['products'][1:3])
+
+        self.assertEqual(rows[0], ['ID', 'title', 'Category title', 'unit price', 'inventory', 'Inventory status',
+                                   'Num of comments'])
+        self.assertEqual(rows[1], [str(dataset['products'][1]), 'product 5-1', 'category 5', '11.00', '100', 'HIGH', '5'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(queries, 2)
+
+        # select across keeps the changelist filters, 5 rows are 3 chunks
+        url = f'/admin/shop/product/?category__id__exact={dataset["category"]}'
+        rows, queries = self.export(url, dataset['products'][:1], select_across=True)
+        self.assertEqual([row[0] for row in rows[1:]], [str(product_id) for product_id in dataset['products']])
+        self.assertEqual([row[-1] for row in rows[1:]], ['5'] * 5)
+        self.assertEqual(queries, 4)
+
+
+class EstimatedCountPaginatorTest(ShopTestCase):
+    def test_counts(self):
+        products = self.create_dataset(3)['products']
+        self.assertEqual(EstimatedCountPaginator(Product.objects.filter(pk__in=products[:2]), 10).count, 2)
+        self.assertEqual(EstimatedCountPaginator(Product.objects.filter(pk__in=[]), 10).count, 0)
+
+
+class PopularitySamplerTest(SimpleTestCase):
+    def test_empty_range(self):
+        sampler = PopularitySampler(0, seed=1)
+        self.assertEqual(sampler.sample_distinct(random.Random(1), 3), [])
+        with self.assertRaises(ValueError):
+            sampler.sample(random.Random(1))
+
+    options = {'product_skew': 1.1, 'category_skew': 1.0, 'customer_skew': 0.8, 'hot_fraction': 0.01, 'hot_share': 0.2}
+
+    def top_share(self, values, k):
+        counts = Counter(values)
+        return sum(count for _, count in counts.most_common(k)) / len(values)
+
+    def test_samplers_are_skewed(self):
+        samplers = popularity_samplers(7, self.options, products=1000, categories=50, customers=500)
+        rng = random.Random(7)
+        # the top 1% of the products, top 10% of the categories and customers
+        self.assertGreater(self.top_share([samplers['products'].sample(rng) for _ in range(10000)], 10), 0.4)
+        self.assertGreater(self.top_share([samplers['categories'].sample(rng) for _ in range(10000)], 5), 0.35)
+        self.assertGreater(self.top_share([samplers['customers'].sample(rng) for _ in range(10000)], 50), 0.35)
+
+        uniform = PopularitySampler(1000, exponent=0, seed=7)
+        self.assertLess(self.top_share([uniform.sample(rng) for _ in range(10000)], 10), 0.05)
+
+    def test_request_mix_is_skewed(self):
+        samplers = popularity_samplers(7, self.options, products=1000, categories=50)
+        requests = list(request_mix(7, samplers['products'], samplers['categories'], 5000))
+
+        names = Counter(request['name'] for request in requests)
+        self.assertEqual(names.most_common(1)[0][0], 'product_detail')
+        details = [request['path'] for request in requests if request['name'] == 'product_detail']
+        self.assertGreater(self.top_share(details, 10), 0.4)
+
+    def test_output_is_reproducible(self):
+        def requests(seed):
+            samplers = popularity_samplers(seed, self.options, products=1000, categories=50)
+            return list(request_mix(seed, samplers['products'], samplers['categories'], 500))
+        self.assertEqual(requests(7), requests(7))
+        self.assertNotEqual(requests(7), requests(8))
+
+        samplers = popularity_samplers(7, self.options, products=100, categories=5, customers=20)
+        context = {'products': samplers['products'], 'customers': samplers['customers'],
+                   'statuses': [Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED], 'items_per_order': 5}
+        runs = [list(generate_in_chunks(generate_orders, 200, 7, context, batch_size=50, workers=workers))
+                for workers in (1, 1, 3)]
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(runs[0], runs[2])
+
+    def test_setup_fake_data_rejects_missing_parents(self):
+        with self.assertRaisesMessage(CommandError, 'at least one category'):
+            call_command('setup_fake_data', categories=0, products=5, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'at least one customer'):
+            call_command('setup_fake_data', customers=0, orders=5, stdout=StringIO())
+
+
+class OrderHistoryTest(ShopTestCase):
+    def history(self):
+        return OrderHistory(Order.objects.filter(customer=self.customer), ArchivedOrder.objects.filter(customer=self.customer))
+
+    def create_orders(self, days_ago, model=Order):
+        now = timezone.now()
+        for number, days in enumerate(days_ago):
+            fields = {'id': 10 ** 6 + number} if model is ArchivedOrder else dict()
+            model.objects.create(customer=self.customer, datetime_created=now - timedelta(days=days), **fields)
+
+    def days_ago(self, orders):
+        return [(timezone.now() - order.datetime_created).days for order in orders]
+
+    def test_tiers_are_concatenated(self):
+        self.create_orders([1, 2, 3])
+        self.create_orders([4, 5], ArchivedOrder)
+        history = self.history()
+        self.assertEqual(self.days_ago(history[1:4]), [2, 3, 4])
+        self.assertEqual(len(history), 5)
+
+    def test_overlapping_tiers_are_merged(self):
+        self.create_orders([1, 3, 5])
+        self.create_orders([2, 4], ArchivedOrder)
+        history = self.history()
+        self.assertEqual(self.days_ago(history[0:2]), [1, 2])
+        self.assertEqual(self.days_ago(history[2:5]), [3, 4, 5])
+        self.assertEqual(self.days_ago(history), [1, 2, 3, 4, 5])
+
+
+class OrderTransitionTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.unpaid, self.paid, self.canceled = [
+            Order.objects.create(customer=self.customer, status=status)
+            for status in [Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_PAID, Order.ORDER_STATUS_CANCELED]
+        ]
+        self.counts = OrderStatusCount.objects.rebuild()
+
+    def transition(self, ids, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/orders/transition/', {'ids': ids, 'status': status}, format='json')
+
+    def test_every_order_gets_an_outcome(self):
+        received = list()
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+        orders_status_changed.connect(receiver)
+        self.addCleanup(orders_status_changed.disconnect, receiver)
+
+        self.client.force_authenticate(self.admin)
+        response = self.transition([self.unpaid.id, self.paid.id, self.canceled.id, 10 ** 9], Order.ORDER_STATUS_PAID)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'id': self.unpaid.id, 'result': TRANSITION_DONE},
+            {'id': self.paid.id, 'result': TRANSITION_UNCHANGED},
+            {'id': self.canceled.id, 'result': TRANSITION_INVALID},
+            {'id': 10 ** 9, 'result': TRANSITION_NOT_FOUND},
+        ])
+
+        self.unpaid.refresh_from_db()
+        self.canceled.refresh_from_db()
+        self.assertEqual((self.unpaid.status, self.canceled.status), (Order.ORDER_STATUS_PAID, Order.ORDER_STATUS_CANCELED))
+        self.assertEqual(received[0]['previous_statuses'], {self.unpaid.id: Order.ORDER_STATUS_UNPAID})
+
+        counts = OrderStatusCount.objects.counts()
+        self.assertEqual(counts[Order.ORDER_STATUS_UNPAID], self.counts[Order.ORDER_STATUS_UNPAID] - 1)
+        self.assertEqual(counts[Order.ORDER_STATUS_PAID], self.counts[Order.ORDER_STATUS_PAID] + 1)
+        OrderStatusCount.objects.rebuild()
+        self.assertEqual(OrderStatusCount.objects.counts(), counts)
+
+    def test_customers_cannot_transition(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.transition([self.unpaid.id], Order.ORDER_STATUS_PAID).status_code, 403)
+        self.unpaid.refresh_from_db()
+        self.assertEqual(self.unpaid.status, Order.ORDER_STATUS_UNPAID)
+
+
+class TokenBucketStoreTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_tokens_refill_over_time(self):
+        store = TokenBucketStore()
+        self.assertEqual([store.consume('key', 2, 1, now=100) for _ in range(2)], [0, 0])
+        self.assertEqual(store.consume('key', 2, 1, now=100), 1)
+        self.assertEqual(store.consume('key', 2, 1, now=101), 0)
+        # other keys have their own bucket
+        self.assertEqual(store.consume('other key', 2, 1, now=101), 0)
+
+    def test_buckets_are_shared_through_the_cache(self):
+        # two workers
+        first = TokenBucketStore(cache_alias='default')
+        second = TokenBucketStore(cache_alias='default')
+        first.consume('key', 1, 1, now=100)
+        self.assertGreater(second.consume('key', 1, 1, now=100), 0)
+
+    def test_workers_alternating_on_a_bucket_share_its_capacity(self):
+        first = TokenBucketStore(cache_alias='default')
+        second = TokenBucketStore(cache_alias='default')
+        allowed = [store.consume('key', 5, 0.01, now=100) == 0 for _ in range(5) for store in (first, second)]
+        self.assertEqual(allowed.count(True), 5)
+        # one token refilled in 100 seconds, spent once between them
+        self.assertEqual(first.consume('key', 5, 0.01, now=200), 0)
+        self.assertGreater(second.consume('key', 5, 0.01, now=200), 0)
+
+
+class ThrottleTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        bucket_store.clear()
+        self.addCleanup(bucket_store.clear)
+
+    @override_settings(TOKEN_BUCKET_RATES={'cart_item.create': {'cart': '2/min'}})
+    def test_cart_bucket(self):
+        dataset = self.create_dataset(2)
+        path = f'/carts/{dataset["cart"]}/items/'
+        statuses = [
+            self.client.post(path, {'product': dataset['product'], 'quantity': 1}, format='json').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [201, 201, 429])
+
+        response = self.client.post(path, {'product': dataset['product'], 'quantity': 1}, format='json')
+        self.assertIn('Retry-After', response)
+        # another cart is not held back
+        other_cart = Cart.objects.create()
+        response = self.client.post(f'/carts/{other_cart.id}/items/', {'product': dataset['product'], 'quantity': 1},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(TOKEN_BUCKET_RATES={})
+    def test_unlisted_actions_are_not_throttled(self):
+        dataset = self.create_dataset(2)
+        path = f'/carts/{dataset["cart"]}/items/'
+        for _ in range(5):
+            self.assertEqual(self.client.post(path, {'product': dataset['product'], 'quantity': 1}, format='json')
+                             .status_code, 201)
+
+
+class DailySalesTest(ShopTestCase):
+    def rollups(self):
+        return {
+            (row.product_id, row.status): (row.quantity, row.revenue, row.order_lines)
+            for row in DailyProductSales.objects.all() if any([row.quantity, row.revenue, row.order_lines])
+        }
+
+    def assertMatchesRebuild(self):
+        rollups = self.rollups()
+        rebuild_daily_sales()
+        self.assertEqual(rollups, self.rollups())
+
+    def report(self):
+        today = timezone.localdate()
+        return sales_report(today, today).get()
+
+    def test_checkout(self):
+        dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/orders/', {'cart_id': str(dataset['cart'])}, format='json')
+
+        # one of each product in each of the two orders, then two of each at checkout
+        self.assertEqual(self.rollups()[(dataset['product'], Order.ORDER_STATUS_UNPAID)], (4, Decimal('40.00'), 3))
+        self.assertMatchesRebuild()
+
+    def test_item_edit(self):
+        dataset = self.create_dataset(2)
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/orders/{dataset["order"]}/', {
+                'items': [{'product': dataset['product'], 'quantity': 3, 'unit_price': '5.00'}],
+            }, format='json')
+
+        self.assertEqual(self.rollups()[(dataset['product'], Order.ORDER_STATUS_UNPAID)], (4, Decimal('25.00'), 2))
+        self.assertMatchesRebuild()
+
+    def test_status_change_moves_sales_to_paid(self):
+        dataset = self.create_dataset(2)
+        self.assertEqual(self.report()['quantity_P'], None)
+
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/orders/transition/', {'ids': [dataset['order']], 'status': Order.ORDER_STATUS_PAID},
+                             format='json')
+
+        report = self.report()
+        # products of 10 and 11, one of each per order
+        self.assertEqual((report['quantity_P'], report['revenue_P']), (2, Decimal('21.00')))
+        self.assertEqual((report['quantity_UN'], report['revenue_UN']), (2, Decimal('21.00')))
+        self.assertEqual((report['total_quantity'], report['total_revenue']), (4, Decimal('42.00')))
+        self.assertMatchesRebuild()
+
+    def test_migration_backfills_the_rollups(self):
+        self.create_dataset(2)
+        rollups = self.rollups()
+        DailyProductSales.objects.all().delete()
+        migration = import_module('shop.migrations.0015_daily_product_sales')
+        migration.populate_daily_sales(django_apps, None)
+        self.assertEqual(self.rollups(), rollups)
+
+
+class BenchmarkApiCommandTest(APITransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        object_cache.clear()
+
+    def test_requires_fake_customers(self):
+        category = Category.objects.create(title='category')
+        Product.objects.create(name='product', slug='product', description='...', category=category, unit_price=1,
+                               inventory=1)
+        with self.assertRaisesMessage(CommandError, 'No fake customers'):
+            call_command('benchmark_api', requests=5, stdout=StringIO())
+
+    def test_replays_the_request_mix(self):
+        call_command('setup_fake_data', categories=3, products=20, customers=4, orders=10, carts=2,
+                     comments_per_product=2, seed=1, workers=1, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            stdout = StringIO()
+            # one client, the in-memory sqlite test database locks its tables against concurrent writers
+            call_command('benchmark_api', requests=40, concurrency=1, warmup=5, seed=1, output=output, stdout=stdout)
+            report = stdout.getvalue()
+            self.assertIn('Replaying 40 requests with 1 clients in-process', report)
+            self.assertRegex(report, r'TOTAL\s+35\s')
+            self.assertIn(f'Results saved to {output}.', report)
+
+            stdout = StringIO()
+            call_command('benchmark_api', requests=40, concurrency=1, warmup=5, seed=1, compare=output, stdout=stdout)
+            self.assertIn('  TOTAL: throughput', stdout.getvalue())
+
+        statuses = re.search(r'Statuses: (.*)', report).group(1)
+        self.assertNotIn("'5", statuses)
+
+
+class BenchmarkSerializersCommandTest(SimpleTestCase):
+    def test_reports_every_serializer_and_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            stdout = StringIO()
+            call_command('benchmark_serializers', sizes=[1, 3], repeat=1, output=output, stdout=stdout)
+            report = stdout.getvalue()
+            for name in ['ProductSerializer', 'CategorySerializer', 'CartSerializer', 'OrderForAdminSerializer',
+                         'CustomerSerializer']:
+                self.assertRegex(report, rf'{name}\s+1\s')
+                self.assertRegex(report, rf'{name}\s+3\s')
+            self.assertIn(f'Results saved to {output}.', report)
+
+            stdout = StringIO()
+            call_command('benchmark_serializers', serializers=['ProductSerializer'], sizes=[3], repeat=1, fields=True,
+                         compare=output, stdout=stdout)
+            report = stdout.getvalue()
+        self.assertRegex(report, r'ProductSerializer\s+3\s.*[+-]\d+\.\d%')
+        self.assertRegex(report, r'    price_with_tax\s+[\d.]+ us/object')
+        self.assertNotIn('CartSerializer', report)
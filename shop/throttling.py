@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    number, period = rate.split('/')
+    return int(number), PERIODS[period[0]]
+
+
+class TokenBucketStore:
+    """
+    Token buckets kept per process. With a cache_alias every consume also reads
+    the bucket from the shared cache and keeps the lower of the two token counts,
+    so the workers spend from one bucket instead of one each.
+    """
+
+    def __init__(self, max_keys=100000, cache_alias=None):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+        self.cache_alias = cache_alias
+
+    def shared_cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def consume(self, key, capacity, refill_per_second, now=None):
+        """
+        Takes one token from the bucket of key and returns 0, or returns
+        the seconds to wait until a token is available.
+        """
+        now = now or time.time()
+        # cache round trips stay outside the lock, it is shared by every request of the process
+        shared = self.load(key)
+
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [float(capacity), now]
+                self.buckets[key] = bucket
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            self.buckets.move_to_end(key)
+
+            tokens = self.refill(bucket, capacity, refill_per_second, now)
+            if shared is not None:
+                tokens = min(tokens, self.refill(shared, capacity, refill_per_second, now))
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            bucket[0], bucket[1] = tokens, now
+
+        if self.cache_alias:
+            self.save(key, tokens, now, capacity / refill_per_second)
+        return 0 if allowed else (1 - tokens) / refill_per_second
+
+    @staticmethod
+    def refill(bucket, capacity, refill_per_second, now):
+        tokens, updated_at = bucket
+        return min(capacity, tokens + max(0, now - updated_at) * refill_per_second)
+
+    def load(self, key):
+        cache = self.shared_cache()
+        return cache.get(f'throttle:{key}') if cache else None
+
+    def save(self, key, tokens, updated_at, timeout):
+        self.shared_cache().set(f'throttle:{key}', (tokens, updated_at), timeout=max(1, int(timeout)))
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+bucket_store = TokenBucketStore(
+    max_keys=getattr(settings, 'TOKEN_BUCKET_MAX_KEYS', 100000),
+    cache_alias=getattr(settings, 'TOKEN_BUCKET_CACHE', None),
+)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    kind = None
+    store = bucket_store
+
+    def get_rate(self, view):
+        scope = f'{getattr(view, "basename", None)}.{getattr(view, "action", None)}'
+        return getattr(settings, 'TOKEN_BUCKET_RATES', {}).get(scope, {}).get(self.kind), scope
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request, view):
+        self.delay = 0
+        rate, scope = self.get_rate(view)
+        if rate is None:
+            return True
+
+        ident = self.get_cache_key(request, view)
+        if ident is None:
+            return True
+
+        capacity, period = parse_rate(rate)
+        self.delay = self.store.consume(f'{scope}:{self.kind}:{ident}', capacity, capacity / period)
+        return self.delay == 0
+
+    def wait(self):
+        return self.delay
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'ip'
+
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
+
+
+class CartTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'cart'
+
+    def get_cache_key(self, request, view):
+        cart_id = view.kwargs.get('cart_pk')
+        if cart_id is None and request.method == 'POST':
+            cart_id = request.data.get('cart_id') if hasattr(request.data, 'get') else None
+        return str(cart_id).replace('-', '').lower() if cart_id else None
@@ -0,0 +1,55 @@
+from collections import Counter
+
+from django.db import transaction
+
+from .analytics import track_order_sales
+from .models import Order, OrderStatusCount, Customer
+from .signals import orders_status_changed
+
+
+TRANSITION_DONE = 'transitioned'
+TRANSITION_UNCHANGED = 'unchanged'
+TRANSITION_INVALID = 'invalid_transition'
+TRANSITION_NOT_FOUND = 'not_found'
+
+
+def transition_orders(order_ids, status, sender=None):
+    order_ids = list(dict.fromkeys(order_ids))
+    allowed_from = [
+        from_status for from_status, _ in Order.ORDER_STATUS
+        if Order.can_transition(from_status, status)
+    ]
+
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update().filter(id__in=order_ids).values_list('id', 'status')
+        )
+
+        outcomes = dict()
+        for order_id in order_ids:
+            if order_id not in current:
+                outcomes[order_id] = TRANSITION_NOT_FOUND
+            elif current[order_id] == status:
+                outcomes[order_id] = TRANSITION_UNCHANGED
+            elif current[order_id] in allowed_from:
+                outcomes[order_id] = TRANSITION_DONE
+            else:
+                outcomes[order_id] = TRANSITION_INVALID
+
+        changed = {order_id: current[order_id] for order_id, outcome in outcomes.items() if outcome == TRANSITION_DONE}
+        if changed:
+            with track_order_sales(list(changed)):
+                Order.objects.filter(id__in=list(changed), status__in=allowed_from).update(status=status)
+
+            deltas = Counter({status: len(changed)})
+            deltas.subtract(changed.values())
+            OrderStatusCount.objects.adjust(deltas)
+            Customer.objects.refresh_order_stats(
+                Customer.objects.filter(pk__in=Order.objects.filter(id__in=list(changed)).values('customer_id'))
+            )
+
+            transaction.on_commit(lambda: orders_status_changed.send_robust(
+                sender or Order, order_ids=list(changed), previous_statuses=changed, status=status,
+            ))
+
+    return outcomes
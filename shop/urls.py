@@ -12,6 +12,9 @@ router.register('category', views.CategoryViewSet, basename='category')
 router.register('carts', views.CartViewSet, basename='cart')
 router.register('customers', views.CustomerViewSet, basename='customer')
 router.register('orders', views.OrderViewSet, basename='order')
+router.register('analytics/sales', views.SalesAnalyticsViewSet, basename='sales_analytics')
+router.register('monitoring/db-pool', views.DatabasePoolViewSet, basename='db_pool')
+router.register('monitoring/cache', views.ObjectCacheViewSet, basename='object_cache')
 
 product_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 product_router.register('comments', views.CommentViewSet, basename='product_comment')
@@ -1,30 +1,60 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
+from django.db import transaction
 from django.db.models import Count, Prefetch
+from django.http import Http404, StreamingHttpResponse
 
-from .models import Product, Discount, Category, Comment, Customer, Address, Cart, CartItem, Order, OrderItem
+from .models import Product, Discount, Category, Comment, Customer, Address, Cart, CartItem, Order, OrderItem, \
+    ArchivedOrder, ArchivedOrderItem, OrderStatusCount
 from .serializers import ProductSerializer, CategorySerializer, CommentSerializer, CartSerializer, CartItemSerializer, \
-    CartItemProductSerializer, CartItemAddSerializer, CartItemUpdateSerializer, CustomerSerializer, OrderForAdminSerializer, \
-    OrderForUsersSerializer, OrderItemSerializer, ProductForOrderSerializer, OrderCreateSerializer, OrderUpdateSerializer
-from .filters import ProductFilter
+    CartItemProductSerializer, CartItemAddSerializer, CartItemUpdateSerializer, CustomerSerializer, UserImportSerializer, \
+    EmailSerializer, EmailCampaignSerializer, \
+    OrderForAdminSerializer, OrderForUsersSerializer, OrderItemSerializer, ProductForOrderSerializer, OrderCreateSerializer, OrderUpdateSerializer, \
+    SalesAnalyticsQuerySerializer, SalesReportSerializer, OrderTransitionSerializer, OrderExportQuerySerializer
+from .filters import ProductFilter, CustomerFilter
 from .paginations import DefaultPagination
 from .permissions import IsAdminOrReadOnly, SendPrivateEmailToCustomers
 from .signals import order_created
+from .archive import OrderHistory
+from .onboarding import import_users
+from .mailing import queue_emails
+from .analytics import sales_report
+from .exports import order_export_rows, EXPORT_RENDERERS
+from .replicas import ReplicaReadMixin
+from .pool import pool_stats
+from .cache import object_cache
 
 from django_filters.rest_framework import DjangoFilterBackend
 
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin
 from rest_framework.generics import ListAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, GenericViewSet
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 
 
-class ProductViewSet(ModelViewSet):
+class CachedObjectMixin:
+    # retrieve reads the object from the object cache instead of the queryset
+    def get_object(self):
+        if self.action != 'retrieve':
+            return super().get_object()
+        try:
+            instance = self.get_cached_object(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except (TypeError, ValueError):
+            instance = None
+        if instance is None:
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+
+class ProductViewSet(ReplicaReadMixin, CachedObjectMixin, ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.select_related('category').all()
     filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
@@ -36,10 +66,13 @@ class ProductViewSet(ModelViewSet):
 
     def get_serializer_context(self):
         return {'request': self.request}
+
+    def get_cached_object(self, pk):
+        return Product.objects.cached(pk)
     
     def destroy(self, request, pk):
         product = get_object_or_404(Product.objects.select_related('category'), pk=pk)
-        if product.order_items.count() > 0 : 
+        if product.order_items.exists() or product.archived_order_items.exists(): 
             return Response({'errors': 'Please delete order items first.'}, 
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
         product.delete()
@@ -47,7 +80,7 @@ class ProductViewSet(ModelViewSet):
     
     
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, CachedObjectMixin, ModelViewSet):
     serializer_class = CategorySerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
     search_fields = ['title']
@@ -56,19 +89,21 @@ class CategoryViewSet(ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
     
     def get_queryset(self):
-        return Category.objects.prefetch_related('products').annotate(\
-           number_of_products=Count('products')).all()
+        return Category.objects.annotate(number_of_products=Count('products')).all()
+
+    def get_cached_object(self, pk):
+        return Category.objects.cached(pk)
 
     def destroy(self, request, pk):
-        category = get_object_or_404(Category.objects.prefetch_related('products'), pk=pk)
-        if category.products.count() > 0 : 
+        category = get_object_or_404(Category, pk=pk)
+        if category.products.exists(): 
             return Response({'errors': 'Please delete products first.'}, 
                              status=status.HTTP_405_METHOD_NOT_ALLOWED)
         category.delete()
         return Response('Object was deleted.', status=status.HTTP_204_NO_CONTENT)
     
 
-class CommentViewSet(ModelViewSet):
+class CommentViewSet(ReplicaReadMixin, ModelViewSet):
     serializer_class = CommentSerializer
     
     def get_queryset(self):
@@ -104,16 +139,28 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_pk': self.kwargs.get('cart_pk')}
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Cart.objects.remove_items(instance.cart_id, 1)
+
 
 class CustomerViewSet(ModelViewSet):
     serializer_class = CustomerSerializer
-    queryset = Customer.objects.prefetch_related('orders').all()
+    queryset = Customer.objects.all()
     permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = CustomerFilter
+    ordering_fields = ['id', 'orders_count', 'total_spent', 'last_order_at']
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
-            user_id =request.user.id
-            customer = Customer.objects.get(user_id=user_id)
+            if request.method == 'GET':
+                customer = Customer.objects.cached_by_user(request.user.id)
+            else:
+                customer = Customer.objects.filter(pk=self.request_customer_id()).first()
+            if customer is None:
+                raise Http404
 
             if request.method == 'GET':
                 serializer = CustomerSerializer(customer)
@@ -124,17 +171,57 @@ class CustomerViewSet(ModelViewSet):
                 serializer.save()
                 return Response(serializer.data)
 
-    @action(detail=True, permission_classes=[SendPrivateEmailToCustomers])
+    @action(detail=False, methods=['POST'])
+    def bulk_import(self, request):
+        # every password is hashed in the request, larger files go through the import_users command
+        serializer = UserImportSerializer(data=request.data, many=True, max_length=settings.USER_IMPORT_MAX_ROWS)
+        serializer.is_valid(raise_exception=True)
+        result = import_users(serializer.validated_data)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    def request_customer_id(self):
+        customer = getattr(self.request.user, 'customer', None)
+        return customer.id if customer else None
+
+    @action(detail=True, methods=['GET', 'POST'], permission_classes=[SendPrivateEmailToCustomers])
     def sending_email(self, request, pk):
-        return Response(f"Sending email to customer {pk}")
+        # the old GET sent nothing, it answers as before until clients have moved to POST
+        if request.method == 'GET':
+            return Response(f"Sending email to customer {pk}", headers={'Deprecation': 'true'})
+
+        serializer = EmailSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queued = queue_emails(Customer.objects.filter(pk=pk), **serializer.validated_data)
+        return Response({'queued': queued}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['POST'], permission_classes=[SendPrivateEmailToCustomers])
+    def sending_emails(self, request):
+        serializer = EmailCampaignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        customers = Customer.objects.all()
+        if 'customer_ids' in data:
+            customers = customers.filter(pk__in=data['customer_ids'])
+        if 'filter' in data:
+            filterset = CustomerFilter(data=data['filter'], queryset=customers)
+            if not filterset.is_valid():
+                raise ValidationError({'filter': filterset.errors})
+            customers = filterset.qs
+
+        queued = queue_emails(customers, data['subject'], data['body'])
+        return Response({'queued': queued}, status=status.HTTP_202_ACCEPTED)
 
 
 
 class OrderViewSet(ModelViewSet):
     http_method_names = ['head', 'options', 'get', 'post', 'patch', 'delete']
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['status']
+    ordering_fields = ['id', 'datetime_created']
     
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE']:
+        if self.request.method in ['PATCH', 'DELETE'] or self.action in ['transition', 'export', 'status_counts']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
     
@@ -144,14 +231,84 @@ class OrderViewSet(ModelViewSet):
             Prefetch('items', 
                     queryset=OrderItem.objects.select_related('product').all())).all()
         
+        return self.filter_for_user(queryset)
+    
+    def get_archived_queryset(self):
+        queryset = ArchivedOrder.objects.select_related('customer__user').prefetch_related(
+            Prefetch('items', 
+                    queryset=ArchivedOrderItem.objects.select_related('product').all())).all()
+        
+        return self.filter_for_user(queryset)
+    
+    def filter_for_user(self, queryset):
         user = self.request.user
         
         if user.is_staff:
             return queryset
         
-        return queryset.filter(customer__user_id=user.id)
+        customer = getattr(user, 'customer', None)
+        if customer is None:
+            return queryset.none()
+        return queryset.filter(customer_id=customer.id)
+    
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            archived_order = get_object_or_404(self.get_archived_queryset(), pk=kwargs['pk'])
+            serializer = self.get_serializer(archived_order)
+            return Response(serializer.data)
+    
+    @action(detail=False, methods=['POST'])
+    def transition(self, request):
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        outcomes = serializer.save(sender=self.__class__)
+        
+        return Response({
+            'status': serializer.validated_data['status'],
+            'results': [{'id': order_id, 'result': result} for order_id, result in outcomes.items()],
+        })
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            OrderStatusCount.objects.adjust({instance.status: -1})
+            Customer.objects.refresh_order_stats(Customer.objects.filter(pk=instance.customer_id))
+    
+    @action(detail=False)
+    def status_counts(self, request):
+        counts = OrderStatusCount.objects.counts()
+        return Response({status: counts.get(status, 0) for status, _ in Order.ORDER_STATUS})
+    
+    @action(detail=False)
+    def export(self, request):
+        query_serializer = OrderExportQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = dict(query_serializer.validated_data)
+        
+        render, content_type = EXPORT_RENDERERS[query.pop('output')]
+        response = StreamingHttpResponse(render(order_export_rows(**query)), content_type=content_type)
+        extension = 'csv' if content_type == 'text/csv' else 'ndjson'
+        response['Content-Disposition'] = f'attachment; filename="orders.{extension}"'
+        return response
+    
+    @action(detail=False)
+    def history(self, request):
+        orders = OrderHistory(self.get_queryset(), self.get_archived_queryset())
+        
+        page = self.paginate_queryset(orders)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(orders, many=True)
+        return Response(serializer.data)
              
     def get_serializer_class(self):
+        if self.action == 'transition':
+            return OrderTransitionSerializer
+        
         if self.request.method == 'POST':
             return OrderCreateSerializer
 
@@ -171,17 +328,50 @@ class OrderViewSet(ModelViewSet):
         
     def create(self, request, *args, **kwargs):
        create_order_serializer = OrderCreateSerializer(data=request.data,
-                            context={'user_id' : self.request.user.id})    
+                            context={'user_id' : self.request.user.id, 'customer' : getattr(request.user, 'customer', None)})    
        create_order_serializer.is_valid(raise_exception=True)
        created_order = create_order_serializer.save()
        
        order_created.send_robust(self.__class__, order=created_order)
 
-       serializer = OrderForUsersSerializer(created_order)
+       serializer = OrderForUsersSerializer(self.get_queryset().get(pk=created_order.pk))
        return Response(serializer.data)
 
 
 
+class SalesAnalyticsViewSet(GenericViewSet):
+    serializer_class = SalesReportSerializer
+    permission_classes = [IsAdminUser]
+    
+    def list(self, request):
+        query_serializer = SalesAnalyticsQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        rows = sales_report(**query_serializer.validated_data)
+        
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(rows, many=True)
+        return Response(serializer.data)
+
+
+class DatabasePoolViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        # the pools of the worker process that served this request
+        return Response(pool_stats())
+
+
+class ObjectCacheViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        return Response(object_cache.stats())
+
+
 # class ProductList(ListCreateAPIView):
 #     serializer_class = ProductSerializer
 #     queryset = Product.objects.select_related('category').all()